@@ -5,11 +5,11 @@ import os
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 from config import logger
-from utils import get_save_directory, delete_media_records, get_duplicate_info
+from utils import resolve_save_directory, delete_media_records, get_duplicate_info
 from bot import state
 from bot.media_group import process_media_group
 from bot.download import (
-    MEDIA_LABELS, _single_buttons, build_progress_bar, _stub_user,
+    MEDIA_LABELS, _single_buttons, build_progress_bar,
     download_large_from_record, download_small_from_record,
 )
 
@@ -235,24 +235,20 @@ async def _handle_delete(query, collection_key):
         # 通过预测文件名尝试物理删除未入库文件
         base_timestamp = group_info.get('base_timestamp')
         media_group_id = group_info.get('media_group_id')
-        user_stub = _stub_user({
-            'user_id': group_info.get('user_id'),
-            'user_name': group_info.get('user_name'),
-        })
-        save_dir = get_save_directory(user_stub, group_info.get('source_name'), group_info.get('source_type'))
+        save_dir = resolve_save_directory(group_info.get('source_name'), group_info.get('source_type'))
 
         extra_deleted = 0
         if base_timestamp and media_group_id:
             for i, item in enumerate(media_items, 1):
                 ext = ".mp4" if item.get('media_type') == 'video' else ".jpg"
-                for fname in (f"{media_group_id}_{i}_{base_timestamp}{ext}", f"{base_timestamp}_temp_{i}"):
-                    fpath = os.path.join(save_dir, fname)
-                    if os.path.exists(fpath):
-                        try:
-                            os.remove(fpath)
-                            extra_deleted += 1
-                        except Exception:
-                            pass
+                final_name = f"{media_group_id}_{i}_{base_timestamp}{ext}"
+                # 连同下载中断留下的 .part 一起清理
+                for fname in (final_name, f"{final_name}.part"):
+                    try:
+                        os.remove(os.path.join(save_dir, fname))
+                        extra_deleted += 1
+                    except OSError:
+                        pass
 
     retry_keyboard = InlineKeyboardMarkup([[
         InlineKeyboardButton("♻️ 重新下载本次", callback_data=f"mg_retry_this:{collection_key}"),
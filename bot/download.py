@@ -8,6 +8,7 @@ Pyrogram (User API) 仍跑在自己的事件循环线程里，通过同步封装
 import os
 import time
 import asyncio
+from dataclasses import dataclass
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
@@ -15,7 +16,8 @@ from config import logger, USER_API_ENABLED
 from utils import (
     get_save_directory, generate_temp_filename, get_image_extension,
     get_video_extension, save_to_db, get_duplicate_info, delete_media_records,
-    get_message_date, get_message_id, utc_to_local,
+    get_message_date, get_message_id, utc_to_local, drop_page_cache,
+    read_file_header,
 )
 import user_api
 from bot import state
@@ -35,6 +37,21 @@ DOWNLOAD_METHOD_BOT = 'bot_api'
 DOWNLOAD_METHOD_USER = 'user_api'
 
 
+@dataclass(slots=True, frozen=True)
+class _UserStub:
+    """脱离原始 update 时，供 save_to_db / get_save_directory 使用的轻量 user 对象。"""
+    id: int
+    username: str
+    first_name: str
+
+
+@dataclass(slots=True, frozen=True)
+class _MediaStub:
+    """供 save_to_db 使用的轻量媒体对象（只需 file_id / file_unique_id）。"""
+    file_id: str
+    file_unique_id: str
+
+
 def get_media_label(media_type):
     return MEDIA_LABELS.get(media_type, media_type or '媒体')
 
@@ -76,10 +93,7 @@ def build_progress_bar(media_items, items_status, item_progress):
 
 
 def save_media_metadata(user, media_info, final_filename, save_dir, media_group_id=None, fallback_link1=None, message_time=None):
-    media_obj_stub = type('Media', (), {
-        'file_id': media_info['file_id'],
-        'file_unique_id': media_info['file_unique_id'],
-    })
+    media_obj_stub = _MediaStub(media_info['file_id'], media_info['file_unique_id'])
     return save_to_db(
         user, media_obj_stub, final_filename,
         save_dir=save_dir, media_group_id=media_group_id,
@@ -95,6 +109,73 @@ def save_media_metadata(user, media_info, final_filename, save_dir, media_group_
     )
 
 
+async def get_file_cached(bot, file_id):
+    """bot.get_file 的缓存版本：同一 file_id 在有效期内只调用一次 getFile。"""
+    tg_file = state.get_cached_file(file_id)
+    if tg_file is None:
+        tg_file = await bot.get_file(file_id)
+        state.put_cached_file(file_id, tg_file)
+    return tg_file
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _finish_bot_download(data, target_path):
+    """把下载到内存的内容写入最终路径并释放页缓存，在线程池中执行。
+
+    先写 .part 并 fsync，再 os.replace 为最终文件名：进程崩溃或断电都只会
+    留下 .part（由临时文件清理任务回收），不会出现看似完整、实际被截断的媒体文件。
+    """
+    part_path = f"{target_path}.part"
+    try:
+        with open(part_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part_path, target_path)
+    except BaseException:
+        _remove_quietly(part_path)
+        raise
+    drop_page_cache(target_path)
+
+
+async def download_via_bot_api(bot, file_id, save_dir, name_stem, detect_ext):
+    """通过 Bot API 下载并保存为 name_stem + ext，返回最终文件名。
+
+    detect_ext 可以是事先已知的扩展名字符串，也可以是按内容识别扩展名的函数；
+    后者直接对内存中的文件头识别，确定扩展名后写入 <最终文件名>.part 再改名为最终文件名
+    (见 _finish_bot_download)。
+    单条 handler、按钮重下与媒体组共用，并发数受 state.bot_api_download_semaphore 限制。
+    Bot API 文件不超过 20MB，先整体下载到内存 (download_as_bytearray)，
+    写盘等阻塞的文件系统调用都放到默认线程池，慢盘/网络盘上不卡住事件循环。
+    下载到的字节数与 Telegram 给出的 file_size 不符时视为失败，不写盘。
+    失败时丢弃 File 缓存后重新抛出，由调用方决定如何记录；未完成的 .part
+    由 _finish_bot_download 自行清理，最终路径上可能已有的旧文件
+    (例如媒体组强制重下沿用同一文件名) 不去动它。
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        # 只有网络部分占用并发名额，识别扩展名与写盘不必排队
+        async with state.bot_api_download_semaphore:
+            tg_file = await get_file_cached(bot, file_id)
+            data = await tg_file.download_as_bytearray()
+        if tg_file.file_size and len(data) != tg_file.file_size:
+            raise Exception(f"下载不完整: 收到 {len(data)} 字节, 应为 {tg_file.file_size} 字节")
+        ext = detect_ext if isinstance(detect_ext, str) else detect_ext(data)
+        final_filename = f"{name_stem}{ext}"
+        target_path = os.path.join(save_dir, final_filename)
+        await loop.run_in_executor(None, lambda: _finish_bot_download(data, target_path))
+        return final_filename
+    except Exception:
+        state.drop_cached_file(file_id)
+        raise
+
+
 def _single_buttons(single_key, is_dup, has_failed):
     """构造单条消息的操作按钮。
 
@@ -205,11 +286,7 @@ def _make_progress_callback(bot, loop, chat_id, status_message_id, prefix, heade
 
 def _stub_user(record):
     """从 record 重建一个供 save_to_db 使用的轻量 user 对象。"""
-    return type('User', (), {
-        'id': record.get('user_id'),
-        'username': record.get('user_name'),
-        'first_name': record.get('user_name'),
-    })
+    return _UserStub(record.get('user_id'), record.get('user_name'), record.get('user_name'))
 
 
 async def download_large_from_record(bot, record, status_chat_id, status_message_id, header=None):
@@ -277,7 +354,7 @@ async def download_large_from_record(bot, record, status_chat_id, status_message
     if not success:
         return None
 
-    media_obj_stub = type('Media', (), {'file_id': record['file_id'], 'file_unique_id': file_unique_id})
+    media_obj_stub = _MediaStub(record['file_id'], file_unique_id)
     save_to_db(
         _stub_user(record), media_obj_stub, final_filename,
         save_dir=date_dir, media_type=media_type, caption=record.get('caption'),
@@ -297,21 +374,12 @@ async def download_small_from_record(bot, record):
     """基于 record 通过 Bot API 重新下载小文件。返回最终文件名或 None。"""
     media_type = record['media_type']
     date_dir = record['date_dir']
-    temp_filename = generate_temp_filename()
-    temp_path = os.path.join(date_dir, f"{temp_filename}_temp")
+    detect_ext = get_video_extension if media_type == 'video' else get_image_extension
     try:
-        tg_file = await bot.get_file(record['file_id'])
-        await tg_file.download_to_drive(temp_path)
-
-        if media_type == 'video':
-            ext = get_video_extension(temp_path)
-        else:
-            ext = get_image_extension(temp_path)
-        final_filename = f"{temp_filename}{ext}"
-        final_path = os.path.join(date_dir, final_filename)
-        os.rename(temp_path, final_path)
+        final_filename = await download_via_bot_api(
+            bot, record['file_id'], date_dir, generate_temp_filename(), detect_ext)
 
-        media_obj_stub = type('Media', (), {'file_id': record['file_id'], 'file_unique_id': record['file_unique_id']})
+        media_obj_stub = _MediaStub(record['file_id'], record['file_unique_id'])
         save_to_db(
             _stub_user(record), media_obj_stub, final_filename,
             save_dir=date_dir, media_type=media_type, caption=record.get('caption'),
@@ -326,11 +394,6 @@ async def download_small_from_record(bot, record):
         record['final_filename'] = final_filename
         return final_filename
     except Exception as e:
-        if os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except Exception:
-                pass
         logger.error(f"{MEDIA_LABELS.get(media_type, '文件')}重新下载失败: {e}")
         return None
 
@@ -405,22 +468,13 @@ async def download_large_via_user_api(update, context, media_obj, media_type, da
 async def save_small_file(update, media_obj, media_type, date_dir, source_info, detect_ext):
     """通过 Bot API 下载小文件并存库。返回最终文件名或 None。
 
-    v21 中 get_file() 与 file.download_to_drive() 均为协程。
-    detect_ext 与 save_to_db 是同步的轻量操作，直接调用即可。
+    下载/识别扩展名/重命名由 download_via_bot_api 完成；save_to_db 是同步的轻量操作，直接调用即可。
     """
     message_time = utc_to_local(get_message_date(update.message)).isoformat() if update.message and update.message.date else None
 
-    temp_filename = generate_temp_filename()
-    temp_path = os.path.join(date_dir, f"{temp_filename}_temp")
-
     try:
-        media_file = await media_obj.get_file()
-        await media_file.download_to_drive(temp_path)
-
-        ext = detect_ext(temp_path)
-        final_filename = f"{temp_filename}{ext}"
-        final_path = os.path.join(date_dir, final_filename)
-        os.rename(temp_path, final_path)
+        final_filename = await download_via_bot_api(
+            update.get_bot(), media_obj.file_id, date_dir, generate_temp_filename(), detect_ext)
 
         save_to_db(
             update.effective_user, media_obj, final_filename,
@@ -431,37 +485,30 @@ async def save_small_file(update, media_obj, media_type, date_dir, source_info,
             message_time=message_time,
             message_id=get_message_id(update.message),
         )
-        logger.info(f"已保存{MEDIA_LABELS.get(media_type, '文件')}: {final_path}")
+        logger.info(f"已保存{MEDIA_LABELS.get(media_type, '文件')}: {os.path.join(date_dir, final_filename)}")
         return final_filename
     except Exception as e:
-        if os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except Exception:
-                pass
         logger.error(f"{MEDIA_LABELS.get(media_type, '文件')}下载失败: {e}")
         return None
 
 
-def get_archive_ext(file_path):
-    """通过文件头检测压缩包/文档类型，返回扩展名。"""
-    try:
-        with open(file_path, 'rb') as f:
-            header = f.read(8)
-        if header[:2] == b'PK':
-            return '.zip'
-        if header[:4] == b'Rar!':
-            return '.rar'
-        if header[:6] == b'7z\xbc\xaf\x27\x1c':
-            return '.7z'
-        if header[:2] == b'\x1f\x8b':
-            return '.gz'
-        if header[:5] == b'\xfd7zXZ':
-            return '.xz'
-        if header[:4] == b'\x25\x50\x44\x46':
-            return '.pdf'
-        if header[:8] == b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1':
-            return '.doc'  # OLE2 format (doc/xls/ppt)
-        return None
-    except Exception:
+def get_archive_ext(source):
+    """通过文件头检测压缩包/文档类型，返回扩展名。source 可以是路径或内存中的文件内容。"""
+    header = read_file_header(source, 8)
+    if not header:
         return None
+    if header[:2] == b'PK':
+        return '.zip'
+    if header[:4] == b'Rar!':
+        return '.rar'
+    if header[:6] == b'7z\xbc\xaf\x27\x1c':
+        return '.7z'
+    if header[:2] == b'\x1f\x8b':
+        return '.gz'
+    if header[:5] == b'\xfd7zXZ':
+        return '.xz'
+    if header[:4] == b'\x25\x50\x44\x46':
+        return '.pdf'
+    if header[:8] == b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1':
+        return '.doc'  # OLE2 format (doc/xls/ppt)
+    return None
@@ -9,6 +9,7 @@ import os
 import re
 import time
 import uuid
+from datetime import datetime
 
 from config import logger, USER_API_ENABLED, ALLOWED_FILE_EXTENSIONS
 from utils import (
@@ -18,8 +19,7 @@ from utils import (
 from bot import state
 from bot.helpers import restricted, get_forward_source_info
 from bot.media_group import (
-    add_photo_to_collection, add_video_to_collection,
-    schedule_media_group_processing, process_media_group,
+    add_media_to_collection, schedule_media_group_processing, process_media_group,
 )
 from bot.download import (
     LARGE_FILE_THRESHOLD, MEDIA_LABELS,
@@ -31,53 +31,72 @@ from bot.download import (
 )
 import user_api
 
+# 文本中的 Telegram 消息链接
+_TME_LINK_RE = re.compile(r'https?://t\.me/\S+')
+
+# 常见 mime 类型对应的扩展名；表中没有的退回 mime 子类型
+_MIME_TO_EXT = {
+    'video/mp4': '.mp4',
+    'video/quicktime': '.mov',
+    'video/x-matroska': '.mkv',
+    'video/webm': '.webm',
+    'video/x-msvideo': '.avi',
+    'image/gif': '.gif',
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+}
+
+
+# 固定文案在导入时构造一次；欢迎语只有用户名需要按次填入
+_WELCOME_TEMPLATE = (
+    "你好 {name}！我是 TeleGrabber 机器人。\n\n"
+    "我可以自动保存你发送的图片、视频和 GIF 动画。\n\n"
+    "支持的媒体类型：\n"
+    "✅ 图片 (JPG, PNG, WEBP 等)\n"
+    "✅ 视频 (MP4, AVI, MOV 等)\n"
+    "✅ GIF 动画\n"
+    "✅ 媒体组/相册（包含图片和视频）\n\n"
+    "⚠️ 注意：超过 20MB 的文件会自动通过 User API 下载（需配置）。\n\n"
+    "发送 /help 查看更多帮助信息。"
+)
+
+_HELP_MESSAGE = (
+    "💡 TeleGrabber 使用指南:\n\n"
+    "直接发送以下内容给我，我会自动保存：\n"
+    "• 单张图片\n"
+    "• 单个视频\n"
+    "• GIF 动画\n"
+    "• 媒体组（相册）\n"
+    "• 图片文件\n\n"
+
+    "📁 文件保存路径：\n"
+    "• 媒体文件按来源自动分类存储（统一媒体库）\n"
+    "• 格式：downloads/来源名称/文件名\n\n"
+
+    "🔍 额外信息：\n"
+    "• 所有媒体元数据会保存到 SQLite 数据库中并记录用户信息\n"
+    "• 自动检测重复资源并跳过，节省磁盘空间\n"
+    "• 大文件下载时会显示实时进度\n"
+    "• 发送 /link 通过 User API 下载账号可见消息中的媒体，支持三种写法：\n"
+    "    /link https://t.me/频道/123\n"
+    "    /link 频道用户名 123\n"
+    "    /link -1001234567890 123\n"
+    "• 发送 /stats 查看媒体库统计\n"
+    "• 支持断网重连和代理设置\n"
+)
+
 
 @restricted
 async def start(update, context) -> None:
     """发送启动消息"""
-    user = update.effective_user
-    welcome_message = (
-        f"你好 {user.first_name}！我是 TeleGrabber 机器人。\n\n"
-        f"我可以自动保存你发送的图片、视频和 GIF 动画。\n\n"
-        f"支持的媒体类型：\n"
-        f"✅ 图片 (JPG, PNG, WEBP 等)\n"
-        f"✅ 视频 (MP4, AVI, MOV 等)\n"
-        f"✅ GIF 动画\n"
-        f"✅ 媒体组/相册（包含图片和视频）\n\n"
-        f"⚠️ 注意：超过 20MB 的文件会自动通过 User API 下载（需配置）。\n\n"
-        f"发送 /help 查看更多帮助信息。"
-    )
-    await update.message.reply_text(welcome_message)
+    await update.message.reply_text(_WELCOME_TEMPLATE.format(name=update.effective_user.first_name))
 
 
 @restricted
 async def help_command(update, context) -> None:
     """发送帮助信息"""
-    help_message = (
-        f"💡 TeleGrabber 使用指南:\n\n"
-        f"直接发送以下内容给我，我会自动保存：\n"
-        f"• 单张图片\n"
-        f"• 单个视频\n"
-        f"• GIF 动画\n"
-        f"• 媒体组（相册）\n"
-        f"• 图片文件\n\n"
-
-        f"📁 文件保存路径：\n"
-        f"• 媒体文件按来源自动分类存储（统一媒体库）\n"
-        f"• 格式：downloads/来源名称/文件名\n\n"
-
-        f"🔍 额外信息：\n"
-        f"• 所有媒体元数据会保存到 SQLite 数据库中并记录用户信息\n"
-        f"• 自动检测重复资源并跳过，节省磁盘空间\n"
-        f"• 大文件下载时会显示实时进度\n"
-        f"• 发送 /link 通过 User API 下载账号可见消息中的媒体，支持三种写法：\n"
-        f"    /link https://t.me/频道/123\n"
-        f"    /link 频道用户名 123\n"
-        f"    /link -1001234567890 123\n"
-        f"• 发送 /stats 查看媒体库统计\n"
-        f"• 支持断网重连和代理设置\n"
-    )
-    await update.message.reply_text(help_message)
+    await update.message.reply_text(_HELP_MESSAGE)
 
 
 @restricted
@@ -162,6 +181,8 @@ async def _process_link(update, context, args):
     total = len(media_items)
     media_group_id = media_items[0].get('media_group_id') or ''
     for media_info in media_items:
+        # Pyrogram Message 对象不可序列化，留在 media_items 里会让媒体组快照整体写盘失败
+        media_info.pop('message', None)
         media_info['download_method'] = DOWNLOAD_METHOD_USER
         media_info['link_chat_id'] = chat_id
         media_info['link_message_id'] = media_info['message_id']
@@ -177,6 +198,7 @@ async def _process_link(update, context, args):
             'user_id': user.id,
             'user_name': user.username or user.first_name,
             'media_items': media_items,
+            'first_time': datetime.now().isoformat(),
             'status_message_id': status_message.message_id,
             'source_name': first_item.get('source_name'),
             'source_username': first_item.get('source_username'),
@@ -342,6 +364,19 @@ async def link_command(update, context) -> None:
     await _process_link(update, context, context.args)
 
 
+def _find_tme_link(text):
+    """返回文本中明文出现的第一个 t.me 链接，没有则返回 None。
+
+    不看超链接文字 (text_link)：转发的频道帖常带指向频道的"订阅"页脚链接，
+    把它当作下载目标会误触发下载或报错。
+    """
+    # 绝大多数文本不含链接，先用子串判断跳过正则
+    if 't.me/' not in text:
+        return None
+    match = _TME_LINK_RE.search(text)
+    return match.group(0) if match else None
+
+
 @restricted
 async def handle_text_message(update, context) -> None:
     """自动识别文本中的 Telegram 消息链接并下载，否则用 LLM 分析转发文本。"""
@@ -349,9 +384,9 @@ async def handle_text_message(update, context) -> None:
     text = message.text or ''
     append_audit('text', message=message, note=f"text_len:{len(text)}")
 
-    match = re.search(r'https?://t\.me/\S+', text)
-    if match:
-        await _process_link(update, context, [match.group(0)])
+    link = _find_tme_link(text)
+    if link:
+        await _process_link(update, context, [link])
         return
 
     if getattr(message, 'has_protected_content', False):
@@ -466,48 +501,44 @@ async def _handle_single_media(update, context, media_obj, media_type, ext_for_l
     )
 
 
-@restricted
-async def process_photo(update, context) -> None:
-    """处理所有照片，包括单张和媒体组中的照片"""
+async def _collect_group_item(update, context, media_obj, media_type):
+    """媒体组内的照片/视频：加入收集（首条会发送状态消息，需 await）并重置收集计时器。"""
     message = update.message
-    user = update.effective_user
     chat_id = update.effective_chat.id
-    media_group_id = message.media_group_id
+    await add_media_to_collection(
+        message.media_group_id, chat_id, update.effective_user, media_obj, media_type, context, message,
+        get_forward_source_info(message), chat_type=message.chat.type,
+    )
+    schedule_media_group_processing(context, message.media_group_id, chat_id)
 
-    if not media_group_id:
-        photo = message.photo[-1]
-        await _handle_single_media(
-            update, context, photo, 'photo',
-            ext_for_large='.jpg', detect_ext=get_image_extension,
-        )
+
+@restricted
+async def process_photo(update, context) -> None:
+    """处理所有照片，包括单张和媒体组中的照片"""
+    photo = update.message.photo[-1]
+    if update.message.media_group_id:
+        await _collect_group_item(update, context, photo, 'photo')
         return
 
-    # 媒体组处理（收集需 await，因首条会发送状态消息）
-    photo = message.photo[-1]
-    _, is_first_media = await add_photo_to_collection(media_group_id, chat_id, user, photo, context, message)
-    if is_first_media:
-        schedule_media_group_processing(context, media_group_id, chat_id)
+    # Telegram 压缩后的照片一律是 JPEG，无需下载后再识别
+    await _handle_single_media(
+        update, context, photo, 'photo',
+        ext_for_large='.jpg', detect_ext='.jpg',
+    )
 
 
 @restricted
 async def process_video(update, context) -> None:
     """处理所有视频，包括单个和媒体组中的视频"""
-    message = update.message
-    user = update.effective_user
-    chat_id = update.effective_chat.id
-    media_group_id = message.media_group_id
-
-    if not media_group_id:
-        await _handle_single_media(
-            update, context, message.video, 'video',
-            ext_for_large='.mp4', detect_ext=get_video_extension,
-        )
+    video = update.message.video
+    if update.message.media_group_id:
+        await _collect_group_item(update, context, video, 'video')
         return
 
-    video = message.video
-    _, is_first_media = await add_video_to_collection(media_group_id, chat_id, user, video, context, message)
-    if is_first_media:
-        schedule_media_group_processing(context, media_group_id, chat_id)
+    await _handle_single_media(
+        update, context, video, 'video',
+        ext_for_large='.mp4', detect_ext=get_video_extension,
+    )
 
 
 @restricted
@@ -521,20 +552,18 @@ async def download_document(update, context) -> None:
         await message.reply_text("❌ 只支持图片文件", reply_to_message_id=message.message_id)
         return
 
-    # 大文件优先使用原始文件名的扩展名，小文件则按内容检测
-    large_ext = '.jpg'
-    if document.file_name and '.' in document.file_name:
-        large_ext = os.path.splitext(document.file_name)[1].lower()
+    # 大文件优先使用原始文件名的扩展名，其次按 mime；小文件则按内容检测
+    large_ext = _ext_from_name_or_mime(document.file_name, mime_type, '.jpg')
 
-    def detect_ext(temp_path):
+    def detect_ext(data):
         if document.file_name and '.' in document.file_name:
             name_ext = os.path.splitext(document.file_name)[1].lower()
-            detected = get_image_extension(temp_path)
+            detected = get_image_extension(data)
             if name_ext.lower() != detected.lower():
                 logger.warning(f"文件扩展名不匹配: 原始={name_ext}, 检测={detected}, 使用检测结果")
                 return detected
             return name_ext
-        return get_image_extension(temp_path)
+        return get_image_extension(data)
 
     await _handle_single_media(
         update, context, document, 'document',
@@ -542,31 +571,34 @@ async def download_document(update, context) -> None:
     )
 
 
+def _ext_from_name_or_mime(file_name, mime_type, default):
+    """下载前确定扩展名：优先取原始文件名的扩展名，其次按 mime 查表，最后退回 default。"""
+    if file_name:
+        name_ext = os.path.splitext(file_name)[1].lower()
+        if name_ext:
+            return name_ext
+    if mime_type:
+        ext = _MIME_TO_EXT.get(mime_type)
+        if ext:
+            return ext
+        _, sep, subtype = mime_type.rpartition('/')
+        if sep and subtype:
+            return f'.{subtype}'
+    return default
+
+
 @restricted
 async def download_document_video(update, context) -> None:
     """下载以"文件"方式发送的视频源文件（未压缩，不命中 filters.VIDEO）。"""
     message = update.message
     document = message.document
 
-    large_ext = '.mp4'
-    if document.file_name and '.' in document.file_name:
-        large_ext = os.path.splitext(document.file_name)[1].lower()
-
-    def detect_ext(_temp_path):
-        if document.file_name and '.' in document.file_name:
-            name_ext = os.path.splitext(document.file_name)[1].lower()
-            if name_ext:
-                return name_ext
-        mime_type = getattr(document, 'mime_type', None)
-        if mime_type and '/' in mime_type:
-            guessed = mime_type.split('/')[-1]
-            if guessed:
-                return f'.{guessed}'
-        return '.mp4'
+    # 扩展名只取决于文件名/mime，下载前即可确定；大小文件共用，保证同一媒体扩展名一致
+    ext = _ext_from_name_or_mime(document.file_name, getattr(document, 'mime_type', None), '.mp4')
 
     await _handle_single_media(
         update, context, document, 'video',
-        ext_for_large=large_ext, detect_ext=detect_ext,
+        ext_for_large=ext, detect_ext=ext,
     )
 
 
@@ -576,27 +608,13 @@ async def process_animation(update, context) -> None:
     message = update.message
     animation = message.animation
 
-    large_ext = ".mp4" if animation.mime_type == 'video/mp4' else ".gif"
-
-    def detect_ext(_temp_path):
-        ext = '.gif'
-        mime_type = getattr(animation, 'mime_type', None)
-        if mime_type == 'video/mp4':
-            ext = '.mp4'
-        elif mime_type and '/' in mime_type:
-            fmt = mime_type.split('/')[-1]
-            if fmt:
-                ext = f'.{fmt}'
-        file_name = getattr(animation, 'file_name', '')
-        if file_name and '.' in file_name:
-            name_ext = os.path.splitext(file_name)[1].lower()
-            if name_ext:
-                ext = name_ext
-        return ext
+    # 扩展名只取决于 mime/文件名，下载前即可确定；大小文件共用，保证同一媒体扩展名一致
+    ext = _ext_from_name_or_mime(
+        getattr(animation, 'file_name', None), getattr(animation, 'mime_type', None), '.gif')
 
     await _handle_single_media(
         update, context, animation, 'animation',
-        ext_for_large=large_ext, detect_ext=detect_ext,
+        ext_for_large=ext, detect_ext=ext,
     )
 
 
@@ -618,8 +636,8 @@ async def download_document_archive(update, context) -> None:
         )
         return
 
-    def detect_ext(temp_path):
-        detected = get_archive_ext(temp_path)
+    def detect_ext(data):
+        detected = get_archive_ext(data)
         return detected or ext
 
     await _handle_single_media(
@@ -1,12 +1,22 @@
 """通用辅助函数：访问控制装饰器、转发溯源、带重试下载。"""
 
-import time
 import functools
 
 from config import logger, ALLOWED_USERS, ENABLE_USER_RESTRICTION, GITHUB_REPO
+from utils import sanitize_name
 from bot import state
 
 
+# 未授权提示为固定文案，导入时构造一次
+_UNAUTHORIZED_MESSAGE = (
+    "⛔ 访问受限\n\n"
+    "此机器人是私有实例，仅供特定用户使用。媒体文件将被下载到部署服务器的本地存储中，而不是转发给其他用户。\n\n"
+    "由于这是一个私人存储工具，只有授权用户才能使用此功能。\n\n"
+    "您可以在GitHub上部署自己的TeleGrabber实例：\n"
+    f"{GITHUB_REPO}"
+)
+
+
 def is_user_allowed(update) -> bool:
     """检查用户是否被允许使用机器人"""
     if not ENABLE_USER_RESTRICTION:
@@ -28,29 +38,34 @@ def is_user_allowed(update) -> bool:
 
 
 def restricted(func):
-    """装饰器：仅允许特定用户访问 (适配 async handler)"""
+    """装饰器：仅允许特定用户访问 (适配 async handler)
+
+    未开启用户限制时直接返回原函数，不给每条消息多套一层调用。
+    """
+    if not ENABLE_USER_RESTRICTION:
+        return func
+
     @functools.wraps(func)
     async def wrapped(update, context, *args, **kwargs):
         if not is_user_allowed(update):
             user_id = update.effective_user.id
-            current_time = time.time()
 
             # 检查是否在冷却时间内已经提示过
-            if current_time - state.user_notification_cache.get(user_id, 0) > state.NOTIFICATION_COOLDOWN:
-                unauthorized_message = (
-                    f"⛔ 访问受限\n\n"
-                    f"此机器人是私有实例，仅供特定用户使用。媒体文件将被下载到部署服务器的本地存储中，而不是转发给其他用户。\n\n"
-                    f"由于这是一个私人存储工具，只有授权用户才能使用此功能。\n\n"
-                    f"您可以在GitHub上部署自己的TeleGrabber实例：\n"
-                    f"{GITHUB_REPO}"
-                )
-                await update.message.reply_text(unauthorized_message)
-                state.user_notification_cache[user_id] = current_time
+            if state.should_notify_user(user_id):
+                await update.message.reply_text(_UNAUTHORIZED_MESSAGE)
             return
         return await func(update, context, *args, **kwargs)
     return wrapped
 
 
+# 频道/群组两类转发来源的处理完全相同，只是来源对象所在属性和类型标签不同
+# 格式: {forward_origin.type: (来源 chat 所在属性, source_type)}
+_CHAT_ORIGINS = {
+    "channel": ("chat", "channel"),
+    "chat": ("sender_chat", "group"),
+}
+
+
 def get_forward_source_info(message):
     """获取转发来源的详细信息 (适配 Bot API 7.0 / PTB v21 的 forward_origin)。
 
@@ -65,8 +80,6 @@ def get_forward_source_info(message):
         dict: {source_name, source_username, source_id, source_link1, source_link2,
                source_type, orig_chat_id, orig_msg_id}
     """
-    import re
-
     info = {
         'source_name': None,
         'source_username': None,
@@ -78,48 +91,40 @@ def get_forward_source_info(message):
         'orig_msg_id': None,
     }
 
-    origin = getattr(message, 'forward_origin', None)
-    origin_type = getattr(origin, 'type', None) if origin else None
-
-    if origin_type == "channel":
-        chat = origin.chat
-        info['source_name'] = chat.title or f"chat_{chat.id}"
-        info['source_id'] = str(chat.id)
-        info['source_type'] = "channel"
-        info['orig_chat_id'] = chat.id
-        info['orig_msg_id'] = getattr(origin, 'message_id', None)
-        if chat.username:
-            info['source_username'] = chat.username
-            info['source_link1'] = f"https://t.me/{chat.username}/{info['orig_msg_id']}"
-            info['source_link2'] = f"https://t.me/c/{chat.id}/{info['orig_msg_id']}"
-        else:
-            info['source_link1'] = f"https://t.me/c/{chat.id}/{info['orig_msg_id']}"
-            info['source_link2'] = ''
+    # PTB Message / MessageOrigin 上这些属性总是存在（没有时为 None），直接读取即可
+    origin = message.forward_origin
+    origin_type = origin.type if origin else None
 
-    elif origin_type == "chat":
-        chat = origin.sender_chat
+    chat_origin = _CHAT_ORIGINS.get(origin_type)
+    if chat_origin:
+        chat_attr, source_type = chat_origin
+        chat = getattr(origin, chat_attr)
         info['source_name'] = chat.title or f"chat_{chat.id}"
         info['source_id'] = str(chat.id)
-        info['source_type'] = "group"
+        info['source_type'] = source_type
         info['orig_chat_id'] = chat.id
+        # 频道转发带原消息 ID，链接指向具体消息；群组转发只能指向群组本身
+        suffix = ''
+        if origin_type == "channel":
+            info['orig_msg_id'] = origin.message_id
+            suffix = f"/{info['orig_msg_id']}"
         if chat.username:
             info['source_username'] = chat.username
-            info['source_link1'] = f"https://t.me/{chat.username}"
-            info['source_link2'] = f"https://t.me/c/{chat.id}"
+            info['source_link1'] = f"https://t.me/{chat.username}{suffix}"
+            info['source_link2'] = f"https://t.me/c/{chat.id}{suffix}"
         else:
-            info['source_link1'] = f"https://t.me/c/{chat.id}"
+            info['source_link1'] = f"https://t.me/c/{chat.id}{suffix}"
             info['source_link2'] = ''
 
     elif origin_type == "user":
         user_from = origin.sender_user
         info['source_id'] = str(user_from.id)
         info['orig_chat_id'] = user_from.id
-        is_bot = getattr(user_from, 'is_bot', False)
+        is_bot = user_from.is_bot
+        info['source_type'] = "bot" if is_bot else "private_user"
         if is_bot:
-            info['source_type'] = "bot"
             info['source_name'] = user_from.first_name or f"bot_{user_from.id}"
         else:
-            info['source_type'] = "private_user"
             info['source_name'] = user_from.username or user_from.first_name or f"user_{user_from.id}"
         if user_from.username:
             info['source_username'] = user_from.username
@@ -127,13 +132,13 @@ def get_forward_source_info(message):
             info['source_link2'] = ''
 
     elif origin_type == "hidden_user":
-        info['source_name'] = getattr(origin, 'sender_user_name', None) or "hidden_user"
+        info['source_name'] = origin.sender_user_name or "hidden_user"
         info['source_id'] = "unknown"
         info['source_link1'] = ''
         info['source_link2'] = ''
         info['source_type'] = "private_user"
 
     if info['source_name']:
-        info['source_name'] = re.sub(r'[\\/*?:"<>|]', "_", info['source_name'])
+        info['source_name'] = sanitize_name(info['source_name'])
 
     return info
@@ -7,70 +7,77 @@
 """
 
 import os
-import json
 import time
 import asyncio
 import threading
+import concurrent.futures
 from datetime import datetime
 
+import orjson
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
 
 from config import logger, USER_API_ENABLED
 from utils import (
-    get_save_directory, generate_temp_filename, get_image_extension,
+    get_save_directory, generate_temp_filename,
     get_video_extension, save_to_db, get_duplicate_info, delete_media_records,
     append_audit, get_message_date, get_message_id, utc_to_local,
 )
 import user_api
 from bot import state
-from bot.helpers import get_forward_source_info
-from bot.download import DOWNLOAD_METHOD_BOT, DOWNLOAD_METHOD_USER, build_progress_bar, _stub_user
+from bot.download import (
+    DOWNLOAD_METHOD_BOT, DOWNLOAD_METHOD_USER, build_progress_bar, _stub_user, _MediaStub, download_via_bot_api,
+)
 
 
 def load_media_groups_collection():
     """从文件加载媒体组收集状态（仅在启动时调用一次）"""
     try:
-        if not os.path.exists(state.MEDIA_GROUP_COLLECTION_FILE):
-            return {}
-
-        with open(state.MEDIA_GROUP_COLLECTION_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(state.MEDIA_GROUP_COLLECTION_FILE, 'rb') as f:
+            data = orjson.loads(f.read())
             state.active_collections = data
             logger.info(f"已从磁盘恢复了 {len(state.active_collections)} 个媒体组收集状态")
             return data
+    except FileNotFoundError:
+        return {}
     except Exception as e:
         logger.error(f"加载媒体组收集状态失败: {e}")
         return {}
 
 
-def save_media_groups_collection(collection=None):
-    """保存媒体组收集状态到文件（异步持久化）"""
-    if collection is None:
-        collection = state.active_collections
+# 需要落盘的组级字段（raw_message、chat_type 等只在内存中使用）
+_PERSISTED_KEYS = (
+    'chat_id', 'user_id', 'user_name', 'media_group_id', 'first_time', 'status_message_id',
+    'source_name', 'source_username', 'source_id', 'source_link1', 'source_link2',
+    'source_type', 'caption',
+)
+
+
+def _snapshot_collection(collection):
+    """复制出可序列化的收集状态快照（剔除 raw_message 等不需要落盘的字段）。
+
+    media_items 中的各项仍会被下载线程改写（status 等），写线程序列化时
+    不能直接引用，因此逐项浅拷贝；组级字段按 _PERSISTED_KEYS 一次取出。
+    """
+    snapshot = {}
+    for key, value in collection.items():
+        group = {name: value.get(name) for name in _PERSISTED_KEYS}
+        group['media_items'] = [dict(item) for item in value['media_items']]
+        snapshot[key] = group
+    return snapshot
+
 
+def _write_collection_file(snapshot):
+    """把快照原子地写入状态文件（调用方需持有 _file_lock）。"""
     try:
-        os.makedirs(os.path.dirname(state.MEDIA_GROUP_COLLECTION_FILE), exist_ok=True)
         temp_file = f"{state.MEDIA_GROUP_COLLECTION_FILE}.tmp"
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            serializable_collection = {}
-            for key, value in collection.items():
-                serializable_collection[key] = {
-                    'chat_id': value['chat_id'],
-                    'user_id': value['user_id'],
-                    'user_name': value['user_name'],
-                    'media_group_id': value['media_group_id'],
-                    'media_items': value['media_items'],
-                    'first_time': value['first_time'],
-                    'status_message_id': value.get('status_message_id'),
-                    'source_name': value.get('source_name'),
-                    'source_username': value.get('source_username'),
-                    'source_id': value.get('source_id'),
-                    'source_link1': value.get('source_link1'),
-                    'source_link2': value.get('source_link2'),
-                    'source_type': value.get('source_type'),
-                    'caption': value.get('caption')
-                }
-            json.dump(serializable_collection, f, ensure_ascii=False, indent=2)
+        # orjson 直接输出紧凑的 UTF-8 bytes，在内存中序列化好后一次写入
+        data = orjson.dumps(snapshot)
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+            # 落盘后再替换，避免断电/崩溃后 rename 已生效但内容仍是空文件
+            f.flush()
+            os.fsync(f.fileno())
 
         os.replace(temp_file, state.MEDIA_GROUP_COLLECTION_FILE)
         logger.debug("已将媒体组状态异步持久化到磁盘")
@@ -78,28 +85,63 @@ def save_media_groups_collection(collection=None):
         logger.error(f"保存媒体组收集状态失败: {e}")
 
 
-async def add_photo_to_collection(media_group_id, chat_id, user, photo, context=None, message=None):
-    """将照片添加到媒体组收集中"""
-    src = get_forward_source_info(message)
+# 后台写线程 (write-behind)：调用方只标记"有改动"，不取快照也不等 fsync；
+# 写线程被唤醒后才在锁内取一次快照，突发的整组消息合并为一次落盘。
+_dirty = threading.Event()
+# 串行化写线程与退出时 flush 的写文件操作，二者共用同一个 .tmp 文件
+_file_lock = threading.Lock()
 
-    if media_group_id:
-        return await add_media_to_collection(
-            media_group_id, chat_id, user, photo, 'photo', context, message,
-            src,
-            chat_type=message.chat.type if message else None,
-        )
+
+def _persist_current():
+    # 持有 _file_lock 时取快照，保证后取的快照一定后写入，旧快照不会覆盖新快照
+    with _file_lock:
+        with state.media_group_lock:
+            snapshot = _snapshot_collection(state.active_collections)
+        _write_collection_file(snapshot)
+
+
+def _writer_loop():
+    while True:
+        _dirty.wait()
+        # 先清标记再取快照：取快照期间的新改动会重新置位，不会丢
+        _dirty.clear()
+        try:
+            _persist_current()
+        except Exception as e:
+            logger.error(f"保存媒体组收集状态失败: {e}")
 
 
-async def add_video_to_collection(media_group_id, chat_id, user, video, context=None, message=None):
-    """将视频添加到媒体组收集中"""
-    src = get_forward_source_info(message)
+threading.Thread(target=_writer_loop, name="media-group-writer", daemon=True).start()
 
-    if media_group_id:
-        return await add_media_to_collection(
-            media_group_id, chat_id, user, video, 'video', context, message,
-            src,
-            chat_type=message.chat.type if message else None,
+
+def save_media_groups_collection():
+    """保存媒体组收集状态到文件（异步持久化：唤醒后台写线程后立即返回）
+
+    快照由写线程在 media_group_lock 内获取，调用方持有或不持有该锁均可。
+    """
+    _dirty.set()
+
+
+def flush_media_groups_collection():
+    """同步写入当前收集状态（退出时调用，保证最后一份状态落盘）"""
+    _dirty.clear()
+    _persist_current()
+
+
+def _group_dedupe_index(group):
+    """返回组内去重索引 (file_unique_id 集合, {message_id: 媒体项})，调用方需持有 media_group_lock。
+
+    索引只存在内存中（下划线开头的键不落盘、不写审计），让每次追加的查重为 O(1)；
+    从磁盘恢复的组在首次追加时按 media_items 重建。
+    """
+    index = group.get('_dedupe_index')
+    if index is None:
+        items = group['media_items']
+        index = group['_dedupe_index'] = (
+            {item.get('file_unique_id') for item in items},
+            {item['message_id']: item for item in items if item.get('message_id') is not None},
         )
+    return index
 
 
 async def add_media_to_collection(media_group_id, chat_id, user, media_obj, media_type, context=None, message=None,
@@ -126,6 +168,9 @@ async def add_media_to_collection(media_group_id, chat_id, user, media_obj, medi
         'message_time': utc_to_local(get_message_date(message)).isoformat() if message and message.date else None,
     }
 
+    # 建组时间在锁外取好，缩短临界区（锁内只做字典读写）
+    now_iso = datetime.now().isoformat()
+
     # 锁内原子操作：判定首条 + 占座建组 / 追加
     with state.media_group_lock:
         is_first_media = collection_key not in state.active_collections
@@ -137,7 +182,7 @@ async def add_media_to_collection(media_group_id, chat_id, user, media_obj, medi
                 'user_name': user.username or user.first_name,
                 'media_group_id': media_group_id,
                 'media_items': [media_info],
-                'first_time': datetime.now().isoformat(),
+                'first_time': now_iso,
                 'status_message_id': None,
                 'source_name': src.get('source_name'),
                 'source_username': src.get('source_username'),
@@ -147,25 +192,35 @@ async def add_media_to_collection(media_group_id, chat_id, user, media_obj, medi
                 'source_type': src.get('source_type'),
                 'chat_type': chat_type or (message.chat.type if message else None),
                 'caption': message.caption if message else None,
-                'raw_message': message.to_dict() if message and hasattr(message, 'to_dict') else None,
+                'raw_message': message.to_dict() if message else None,
             }
             need_queue_hint = state.is_processing_media_group or bool(state.pending_media_groups)
         else:
-            existing_items = state.active_collections[collection_key]['media_items']
+            group = state.active_collections[collection_key]
+            existing_items = group['media_items']
+            seen_unique_ids, items_by_message = _group_dedupe_index(group)
             # 二次更新去重：同一条消息被 Telegram 多次推送 (如先发后改) 时，
             # message_id 相同则视为同一项，仅更新不重复追加，避免组内出现重复/错位。
-            duplicate = False
-            if media_info['message_id'] is not None:
-                for existing in existing_items:
-                    if existing.get('message_id') == media_info['message_id']:
-                        existing.update(media_info)
-                        duplicate = True
-                        break
-            if not duplicate:
+            # 网络抖动重投时 message_id 可能不同但文件相同，按 file_unique_id 再查一次，
+            # 保留先到的一项，避免同一文件下载两遍。
+            message_id = media_info['message_id']
+            existing = items_by_message.get(message_id) if message_id is not None else None
+            if existing is not None:
+                old_unique_id = existing.get('file_unique_id')
+                existing.update(media_info)
+                seen_unique_ids.add(media_info['file_unique_id'])
+                # 被替换掉的文件不再占用去重标记，否则之后真正带这个文件的项会被当成重复丢掉
+                if old_unique_id != media_info['file_unique_id'] and not any(
+                        item.get('file_unique_id') == old_unique_id for item in existing_items):
+                    seen_unique_ids.discard(old_unique_id)
+            elif media_info['file_unique_id'] not in seen_unique_ids:
                 existing_items.append(media_info)
+                seen_unique_ids.add(media_info['file_unique_id'])
+                if message_id is not None:
+                    items_by_message[message_id] = media_info
             if not state.active_collections[collection_key].get('caption') and message and message.caption:
                 state.active_collections[collection_key]['caption'] = message.caption
-            logger.debug(f"媒体组 {media_group_id} 追加{media_type}，总数: {len(existing_items)}")
+            logger.debug("媒体组 %s 追加%s，总数: %d", media_group_id, media_type, len(existing_items))
         count = len(state.active_collections[collection_key]['media_items'])
 
     # 仅首条发送状态消息（await 放在锁外），发完回填 message_id
@@ -186,19 +241,47 @@ async def add_media_to_collection(media_group_id, chat_id, user, media_obj, medi
 
 
 def schedule_media_group_processing(context, media_group_id, chat_id):
-    """安排媒体组处理任务 (同步：仅入队 + 注册 JobQueue 回调)"""
+    """安排媒体组处理任务 (同步：注册 / 重置该组的收集计时器)
+
+    每收到一条组内媒体都调用一次：已有计时器则撤销重排（防抖），
+    保证 Telegram 迟到的组内消息仍能并入同一组，而不是在固定 2 秒后被截断。
+    从首条起最多等待 MEDIA_GROUP_MAX_WAIT 秒，计时器到期后才把该组放入处理队列。
+    已入队或正在处理的组不再重排：迟到项已并入收集，再排一次只会让同一组重复入队。
+    """
     collection_key = f"{chat_id}_{media_group_id}"
 
     with state.media_group_lock:
+        if collection_key in state.enqueued_media_groups:
+            return
+        now = time.monotonic()
+        deadline = state.media_group_deadlines.setdefault(collection_key, now + state.MEDIA_GROUP_MAX_WAIT)
+        # 顺延不超过最长等待时间：持续有迟到项时也能按时开始处理
+        delay = min(state.MEDIA_GROUP_COLLECT_TIME, max(0, deadline - now))
+        old_job = state.media_group_jobs.pop(collection_key, None)
+        if old_job is not None:
+            old_job.schedule_removal()
+        state.media_group_jobs[collection_key] = context.job_queue.run_once(
+            _enqueue_media_group,
+            delay,
+            data={'initial_key': collection_key},
+        )
+    logger.debug("已安排媒体组 %s 的处理任务", media_group_id)
+
+
+async def _enqueue_media_group(context):
+    """收集计时器到期：把媒体组放入处理队列并尝试处理 (JobQueue async 回调)"""
+    collection_key = context.job.data['initial_key']
+    with state.media_group_lock:
+        # 已被更晚的计时器取代（撤销与触发竞态时可能发生），交给新的计时器处理
+        if state.media_group_jobs.get(collection_key) is not context.job:
+            return
+        del state.media_group_jobs[collection_key]
+        state.media_group_deadlines.pop(collection_key, None)
+        state.enqueued_media_groups.add(collection_key)
         state.pending_media_groups.append(collection_key)
-        logger.debug(f"媒体组 {media_group_id} 已添加到处理队列，当前队列长度: {len(state.pending_media_groups)}")
+        logger.debug("媒体组 %s 已添加到处理队列，当前队列长度: %d", collection_key, len(state.pending_media_groups))
 
-    context.job_queue.run_once(
-        process_next_media_group,
-        state.MEDIA_GROUP_COLLECT_TIME,
-        data={'initial_key': collection_key},
-    )
-    logger.debug(f"已安排媒体组 {media_group_id} 的处理任务")
+    await process_next_media_group(context)
 
 
 async def process_next_media_group(context):
@@ -218,29 +301,86 @@ async def process_next_media_group(context):
         logger.error(f"处理媒体组 {collection_key} 出错: {e}")
     finally:
         with state.media_group_lock:
+            # 正常结束时已随收集状态一并清除；这里兜底处理中途出错的情况
+            state.enqueued_media_groups.discard(collection_key)
             state.is_processing_media_group = False
             still_pending = bool(state.pending_media_groups)
         if still_pending:
             context.job_queue.run_once(process_next_media_group, 0.5, data={})
 
 
-def _edit_status_threadsafe(bot, loop, chat_id, message_id, text, reply_markup=None):
-    """从下载线程把一次消息编辑调度回主事件循环（不等待结果）。"""
+# 触发 Telegram 限流 (429 RetryAfter) 的聊天，在此时间点 (loop.time()) 之前跳过进度编辑
+_flood_until = {}
+
+
+def _edit_status_threadsafe(bot, loop, chat_id, message_id, text, reply_markup=None, final=False):
+    """从下载线程把一次消息编辑调度回主事件循环（不等待结果）。
+
+    进度编辑遇到限流直接丢弃并在冷却期内跳过后续进度；final=True 的结果消息
+    （带操作按钮）则等待 retry_after 后重试一次，避免最终状态丢失。
+    """
     async def _edit():
-        try:
-            await bot.edit_message_text(
-                chat_id=chat_id, message_id=message_id,
-                text=text, reply_markup=reply_markup,
-                parse_mode='Markdown', disable_web_page_preview=True,
-            )
-        except Exception:
-            pass
+        if not final and loop.time() < _flood_until.get(chat_id, 0):
+            return
+        for attempt in range(2):
+            try:
+                await bot.edit_message_text(
+                    chat_id=chat_id, message_id=message_id,
+                    text=text, reply_markup=reply_markup,
+                    parse_mode='Markdown', disable_web_page_preview=True,
+                )
+                return
+            except RetryAfter as e:
+                _flood_until[chat_id] = loop.time() + e.retry_after
+                if not final or attempt:
+                    return
+                await asyncio.sleep(e.retry_after)
+            except Exception:
+                return
     try:
         asyncio.run_coroutine_threadsafe(_edit(), loop)
     except Exception:
         pass
 
 
+class _ProgressCoalescer:
+    """合并媒体组进度编辑：最多每 interval 秒编辑一次，且最后一次变化一定会显示。
+
+    下载线程只调用 bump()；间隔内的多次 bump 合并为一次，在主事件循环上
+    按计时器执行 render()，render 读取的是执行那一刻的最新进度（尾沿触发）。
+    """
+
+    def __init__(self, loop, render, interval):
+        self._loop = loop
+        self._render = render
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._last = 0.0
+        self._scheduled = False
+        self._closed = False
+
+    def bump(self):
+        with self._lock:
+            if self._closed or self._scheduled:
+                return
+            self._scheduled = True
+            delay = max(0.0, self._last + self._interval - time.monotonic())
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay, self._fire)
+
+    def _fire(self):
+        with self._lock:
+            self._scheduled = False
+            if self._closed:
+                return
+            self._last = time.monotonic()
+        self._render()
+
+    def close(self):
+        """停止后续进度编辑（最终结果消息由调用方单独发送）。"""
+        with self._lock:
+            self._closed = True
+
+
 async def process_media_group(context, collection_key=None, is_retry=False, retry_type=None):
     """处理媒体组：在线程池中并发下载，下载完成后回主循环刷新 UI。
 
@@ -319,11 +459,12 @@ def _run_media_group_blocking(bot, loop, bot_username, collection_key, group_inf
 
     if total_items == 0:
         if status_message_id:
-            _edit_status_threadsafe(bot, loop, chat_id, status_message_id, "❌ 未能处理任何媒体内容")
+            _edit_status_threadsafe(bot, loop, chat_id, status_message_id, "❌ 未能处理任何媒体内容", final=True)
         with state.media_group_lock:
-            if collection_key in state.active_collections:
-                del state.active_collections[collection_key]
-                save_media_groups_collection()
+            removed = state.active_collections.pop(collection_key, None) is not None
+            state.enqueued_media_groups.discard(collection_key)
+        if removed:
+            save_media_groups_collection()
         return
 
     # 清理残留查重标记
@@ -385,7 +526,6 @@ def _run_media_group_blocking(bot, loop, bot_username, collection_key, group_inf
         base_timestamp = generate_temp_filename(media_group_id)
         group_info['base_timestamp'] = base_timestamp
 
-    last_ui_update = {"time": 0}
     is_finished = {"value": False}
     processed_count = {"value": sum(1 for s in items_status if s in [1, 2])}
 
@@ -393,13 +533,7 @@ def _run_media_group_blocking(bot, loop, bot_username, collection_key, group_inf
         # emoji 按实际下载通道区分：Bot API 用 ⏳/🔽/✅/❌，User API 用 🕓/☁️/🟢/🔴。
         return build_progress_bar(media_items, items_status, item_progress)
 
-    def update_ui_async():
-        if is_finished["value"] or not status_message_id:
-            return
-        curr_time = time.time()
-        if curr_time - last_ui_update["time"] <= 1.2:
-            return
-        last_ui_update["time"] = curr_time
+    def render_progress():
         button_list = [
             [
                 InlineKeyboardButton("♻️ 重新下载本次", callback_data=f"mg_retry_this:{collection_key}"),
@@ -419,6 +553,13 @@ def _run_media_group_blocking(bot, loop, bot_username, collection_key, group_inf
             reply_markup=InlineKeyboardMarkup(button_list),
         )
 
+    progress = _ProgressCoalescer(loop, render_progress, state.MEDIA_GROUP_PROGRESS_INTERVAL)
+
+    def update_ui_async():
+        if is_finished["value"] or not status_message_id:
+            return
+        progress.bump()
+
     def download_and_save_task(index, media_info):
         is_internally_saving = False
         file_unique_id = media_info['file_unique_id']
@@ -513,7 +654,7 @@ def _run_media_group_blocking(bot, loop, bot_username, collection_key, group_inf
                     )
 
                 if success:
-                    media_obj_stub = type('Media', (), {'file_id': media_info['file_id'], 'file_unique_id': file_unique_id})
+                    media_obj_stub = _MediaStub(media_info['file_id'], file_unique_id)
                     save_to_db(user_obj, media_obj_stub, final_filename,
                                save_dir=save_dir, media_group_id=media_group_id,
                                media_type=media_info.get('media_type', 'photo'),
@@ -535,23 +676,23 @@ def _run_media_group_blocking(bot, loop, bot_username, collection_key, group_inf
 
             # 小文件走 Bot API：在主事件循环里 await 下载，线程这里阻塞等结果
             media_type = media_info.get('media_type', 'photo')
-            temp_path = os.path.join(save_dir, f"{base_timestamp}_temp_{index}")
-
-            async def _bot_download():
-                tg_file = await bot.get_file(media_info['file_id'])
-                await tg_file.download_to_drive(temp_path)
-
-            fut = asyncio.run_coroutine_threadsafe(_bot_download(), loop)
-            # 设超时兜底：正常不会触发，仅防极端情况下主循环异常导致本线程永久挂起；
-            # 超时会抛 TimeoutError，被下方 except 捕获，该项标记为失败，不拖垮整组。
-            fut.result(timeout=300)
-
-            ext = get_video_extension(temp_path) if media_type == 'video' else get_image_extension(temp_path)
-            final_filename = f"{media_group_id}_{index}_{base_timestamp}{ext}"
-            final_path = os.path.join(save_dir, final_filename)
-            os.rename(temp_path, final_path)
-
-            media_obj_stub = type('Media', (), {'file_id': media_info['file_id'], 'file_unique_id': file_unique_id})
+            # 照片一律是 JPEG，直接写最终文件；视频仍按内容识别容器格式
+            detect_ext = get_video_extension if media_type == 'video' else '.jpg'
+            fut = asyncio.run_coroutine_threadsafe(
+                download_via_bot_api(bot, media_info['file_id'], save_dir,
+                                     f"{media_group_id}_{index}_{base_timestamp}", detect_ext),
+                loop)
+            # 设超时兜底：正常不会触发，仅防极端情况下主循环异常导致本线程永久挂起。
+            # 超时先取消仍在排队等并发名额或下载中的协程，免得它之后写出一个
+            # 既不入库也不计入进度的文件；再抛出 TimeoutError，被下方 except 捕获，
+            # 该项标记为失败，不拖垮整组。
+            try:
+                final_filename = fut.result(timeout=300)
+            except concurrent.futures.TimeoutError:
+                fut.cancel()
+                raise
+
+            media_obj_stub = _MediaStub(media_info['file_id'], file_unique_id)
             db_success = save_to_db(user_obj, media_obj_stub, final_filename,
                                     save_dir=save_dir, media_group_id=media_group_id,
                                     media_type=media_type,
@@ -585,12 +726,19 @@ def _run_media_group_blocking(bot, loop, bot_username, collection_key, group_inf
                 if not is_internally_saving and file_unique_id in state.saving_unique_ids:
                     state.saving_unique_ids.remove(file_unique_id)
 
-    futures = [state.download_executor.submit(download_and_save_task, i, item) for i, item in enumerate(media_items, 1)]
+    # User API 下载在 user_api 内部是串行的（信号量为 1），排在前面会占满线程池而让
+    # Bot API 小文件干等；先提交 Bot API 项，让两类下载真正重叠进行。
+    ordered = sorted(
+        enumerate(media_items, 1),
+        key=lambda pair: pair[1].get('download_method') == DOWNLOAD_METHOD_USER,
+    )
+    futures = [state.download_executor.submit(download_and_save_task, i, item) for i, item in ordered]
     for f in futures:
         f.result()
 
     elapsed_time = time.time() - start_time
     is_finished["value"] = True
+    progress.close()
 
     if status_message_id:
         has_failed = any(s == 3 for s in items_status)
@@ -623,15 +771,18 @@ def _run_media_group_blocking(bot, loop, bot_username, collection_key, group_inf
 
         _edit_status_threadsafe(
             bot, loop, chat_id, status_message_id, finish_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=InlineKeyboardMarkup(keyboard), final=True,
         )
 
     # 清理内存收集状态并移入历史
+    # 锁内只做字典搬移，快照与落盘放到锁外，不阻塞同时到达的其他媒体组消息
     with state.media_group_lock:
-        if collection_key in state.active_collections:
-            state.processed_groups_history[collection_key] = state.active_collections[collection_key]
+        finished = state.active_collections.pop(collection_key, None)
+        state.enqueued_media_groups.discard(collection_key)
+        if finished is not None:
+            state.processed_groups_history[collection_key] = finished
             if len(state.processed_groups_history) > 100:
                 oldest_key = next(iter(state.processed_groups_history))
                 del state.processed_groups_history[oldest_key]
-            del state.active_collections[collection_key]
-            save_media_groups_collection()
+    if finished is not None:
+        save_media_groups_collection()
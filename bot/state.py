@@ -4,8 +4,10 @@
 """
 
 import os
+import time
+import asyncio
 import threading
-from collections import defaultdict, deque
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 
 from config import SAVE_DIR
@@ -14,18 +16,32 @@ from config import SAVE_DIR
 MEDIA_GROUP_STATE_FILE = os.path.join(SAVE_DIR, "media_groups_state.json")
 # 媒体组收集状态文件
 MEDIA_GROUP_COLLECTION_FILE = os.path.join(SAVE_DIR, "media_groups_collection.json")
-# 媒体组收集等待时间（秒）
+# 媒体组收集等待时间（秒），每收到一项重新计时
 MEDIA_GROUP_COLLECT_TIME = 2
+# 媒体组从首条到开始处理的最长等待时间（秒），防止持续有迟到项时无限顺延
+MEDIA_GROUP_MAX_WAIT = 10
+# 媒体组下载进度消息的最小编辑间隔（秒），Telegram 对同一聊天的编辑频率有限制
+MEDIA_GROUP_PROGRESS_INTERVAL = 1.5
 
 # 存储最近提示过的用户，格式为 {user_id: last_notification_time}
-user_notification_cache = defaultdict(int)
+# 按提示时间先后排列，过了冷却期的记录在下次提示时从头部清理，不会无限增长
+user_notification_cache = {}
+notification_lock = threading.Lock()
 # 设置提示冷却时间（秒）
 NOTIFICATION_COOLDOWN = 60
+# 冷却期内记录的用户数上限，防止大量不同 ID 在一个冷却期内刷满内存
+NOTIFICATION_CACHE_LIMIT = 10000
 
 # 添加全局锁，确保同一时间只处理一个媒体组
 media_group_lock = threading.Lock()
 # 添加待处理媒体组队列
 pending_media_groups = deque()
+# 仍在收集中的媒体组的收集计时器 (防抖)，格式: {collection_key: telegram.ext.Job}
+media_group_jobs = {}
+# 收集中媒体组的最晚开始处理时间 (time.monotonic())，格式: {collection_key: deadline}
+media_group_deadlines = {}
+# 收集计时器已到期、已进入处理队列或正在处理的媒体组，之后迟到的组内消息不再重排计时器
+enqueued_media_groups = set()
 # 标记是否有正在处理的媒体组
 is_processing_media_group = False
 
@@ -38,6 +54,10 @@ active_collections = {}
 processed_groups_history = {}
 # 下载执行器：限制为 5 个并发，既能保证速度也能避免触发 Telegram 限制或代理过载
 download_executor = ThreadPoolExecutor(max_workers=5)
+# Bot API 下载的全局并发上限：单条消息、按钮重下与各媒体组共用，
+# 多个媒体组/大量单图同时到达时也不会一起打满 getFile，招来 429 限流
+BOT_API_DOWNLOAD_CONCURRENCY = 5
+bot_api_download_semaphore = asyncio.Semaphore(BOT_API_DOWNLOAD_CONCURRENCY)
 # 用于防止同一媒体组内多个相同文件同时保存导致的查重冲突
 saving_unique_ids = set()
 saving_lock = threading.Lock()
@@ -51,6 +71,15 @@ single_lock = threading.Lock()
 # 历史上限，防止内存无限增长（保留最近 N 条）
 SINGLE_RECORDS_LIMIT = 200
 
+# --- Bot API File 对象缓存 ---
+# getFile 返回的下载链接至少 1 小时有效；按钮重下、重试失败项时复用，省掉一次 getFile 往返。
+# 格式: {file_id: (telegram.File, time.monotonic() 取得时间)}
+file_cache = {}
+file_cache_lock = threading.Lock()
+# 缓存有效期（秒），留出余量早于 Telegram 的 1 小时过期
+FILE_CACHE_TTL = 50 * 60
+FILE_CACHE_LIMIT = 500
+
 
 def put_single_record(key, record):
     """登记一条单张下载记录，超出上限时淘汰最旧的。"""
@@ -71,4 +100,50 @@ def drop_single_record(key):
         single_records.pop(key, None)
 
 
-
+def should_notify_user(user_id):
+    """未授权用户在冷却期内只提示一次。需要提示时登记并返回 True。
+
+    顺带清理已过冷却期的记录：重新登记时先删除再插入，字典始终按时间有序，
+    只需从头部检查，均摊 O(1)。超出 NOTIFICATION_CACHE_LIMIT 时同样从头部淘汰。
+    """
+    now = time.time()
+    with notification_lock:
+        last = user_notification_cache.get(user_id)
+        if last is not None and now - last <= NOTIFICATION_COOLDOWN:
+            return False
+        user_notification_cache.pop(user_id, None)
+        user_notification_cache[user_id] = now
+        while user_notification_cache:
+            oldest = next(iter(user_notification_cache))
+            if (now - user_notification_cache[oldest] <= NOTIFICATION_COOLDOWN
+                    and len(user_notification_cache) <= NOTIFICATION_CACHE_LIMIT):
+                break
+            del user_notification_cache[oldest]
+        return True
+
+
+def get_cached_file(file_id):
+    """取缓存中未过期的 File 对象，没有则返回 None。"""
+    with file_cache_lock:
+        entry = file_cache.get(file_id)
+        if entry is None:
+            return None
+        tg_file, fetched_at = entry
+        if time.monotonic() - fetched_at >= FILE_CACHE_TTL:
+            del file_cache[file_id]
+            return None
+        return tg_file
+
+
+def put_cached_file(file_id, tg_file):
+    """缓存一个 File 对象，超出上限时淘汰最旧的。"""
+    with file_cache_lock:
+        file_cache[file_id] = (tg_file, time.monotonic())
+        while len(file_cache) > FILE_CACHE_LIMIT:
+            del file_cache[next(iter(file_cache))]
+
+
+def drop_cached_file(file_id):
+    """下载失败时丢弃缓存，下次重新 getFile（链接可能已失效）。"""
+    with file_cache_lock:
+        file_cache.pop(file_id, None)
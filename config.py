@@ -2,14 +2,26 @@
 # -*- coding: utf-8 -*-
 
 import os
+import queue
+import atexit
 import logging
+import logging.handlers
 from dotenv import load_dotenv
 
 # 配置日志
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# 实际输出交给后台 QueueListener 线程，调用方只做一次入队，
+# 避免下载/回调热路径上的 logger 调用阻塞在终端或管道的 write 上
+_log_queue = queue.SimpleQueue()
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_output)
+_log_listener.start()
+# 退出时停止监听线程，把队列中剩余的日志写完
+atexit.register(_log_listener.stop)
+_log_enqueue = logging.handlers.QueueHandler(_log_queue)
+# 入队时只合并消息文本，时间/级别等前缀由监听线程统一格式化
+_log_enqueue.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_log_enqueue])
 logger = logging.getLogger(__name__)
 
 def mask_proxy_url(url):
@@ -57,6 +69,9 @@ PROXY = os.getenv('PROXY_URL')  # 可选的代理设置
 TIMEOUT = int(os.getenv('CONNECTION_TIMEOUT', '30'))  # 连接超时设置，默认30秒
 DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES', '3'))  # 下载失败重试次数，默认3次
 WEB_PORT = int(os.getenv('WEB_PORT', '5000'))  # Web 管理后台端口，默认 5000
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', '30'))  # getUpdates 长轮询等待时间，默认30秒
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '256'))  # 同时处理的 update 上限，默认256
+THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', '32'))  # 阻塞文件/数据库操作的线程池大小，默认32
 
 # Web 管理后台登录凭据 (HTTP Basic Auth)
 WEB_USERNAME = os.getenv('WEB_USERNAME', 'admin')
@@ -65,7 +80,8 @@ WEB_PASSWORD = os.getenv('WEB_PASSWORD', '')
 # 允许使用机器人的用户列表
 # 格式为逗号分隔的用户名或用户ID列表，例如: user1,user2,123456789
 ALLOWED_USERS_STR = os.getenv('ALLOWED_USERS', '')
-ALLOWED_USERS = [user.strip() for user in ALLOWED_USERS_STR.split(',') if user.strip()]
+# 用 frozenset 存放，每条消息的权限检查都是 O(1) 哈希查找
+ALLOWED_USERS = frozenset(user.strip() for user in ALLOWED_USERS_STR.split(',') if user.strip())
 
 # 是否启用用户限制功能，如果ALLOWED_USERS为空，则默认不启用
 ENABLE_USER_RESTRICTION = bool(ALLOWED_USERS)
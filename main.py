@@ -2,29 +2,48 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import random
 import signal
 import asyncio
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 )
 import telegram.error
 
-from config import TOKEN, logger, get_connection_args, USER_API_ENABLED, WEB_PORT
+from config import (
+    TOKEN, logger, get_connection_args, USER_API_ENABLED, WEB_PORT,
+    POLLING_TIMEOUT, CONCURRENT_UPDATES, THREAD_POOL_SIZE,
+)
 import bot
-from utils import init_db
+from utils import init_db, sweep_temp_files
 import user_api
 import web_backend
 
 
+# 运行期间定期清理中断下载残留的临时文件（秒）
+TEMP_SWEEP_INTERVAL = 15 * 60
+# 超过该时间未再写入的临时文件才会被清理，避免误删正在下载的大文件
+TEMP_FILE_MAX_AGE = 60 * 60
+
+
+async def sweep_temp_files_job(context):
+    """JobQueue 定时任务：在线程池中扫描并清理过期的临时文件。"""
+    loop = asyncio.get_running_loop()
+    removed = await loop.run_in_executor(None, lambda: sweep_temp_files(min_age=TEMP_FILE_MAX_AGE))
+    if removed:
+        logger.info(f"已清理 {removed} 个过期的临时文件")
+
+
 def build_application():
     """根据配置构造 python-telegram-bot v21 的 Application。"""
     builder = ApplicationBuilder().token(TOKEN)
 
     # 并发处理 update：否则一个耗时 handler（如大文件下载）会阻塞所有后续消息/回调。
-    # PTB v21 默认串行处理，必须显式开启。
-    builder = builder.concurrent_updates(True)
+    # PTB v21 默认串行处理，必须显式开启；上限可通过 CONCURRENT_UPDATES 调整。
+    builder = builder.concurrent_updates(CONCURRENT_UPDATES)
 
     conn = get_connection_args()
     if 'connect_timeout' in conn:
@@ -68,6 +87,9 @@ def build_application():
     # 全局错误处理器
     app.add_error_handler(bot.error_handler)
 
+    # 长时间运行时，中断的下载也会留下临时文件，定期清理而不是等到下次重启
+    app.job_queue.run_repeating(sweep_temp_files_job, interval=TEMP_SWEEP_INTERVAL, first=TEMP_SWEEP_INTERVAL)
+
     return app
 
 
@@ -78,6 +100,12 @@ async def run_bot():
     与 user_api (Pyrogram) 后台线程的事件循环管理存在冲突，
     导致 'Updater.start_polling was never awaited'。这里手动管理生命周期。
     """
+    # handler 里写盘、查库、User API 同步封装等阻塞调用都走 run_in_executor(None, ...)，
+    # 显式设定默认线程池大小，避免随 CPU 核数变化；Runner 退出时会等待其关闭
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="io")
+    )
+
     app = build_application()
 
     # 带重试地连接 Telegram（网络/代理问题给出友好提示，而非直接崩溃）
@@ -88,7 +116,9 @@ async def run_bot():
             logger.info(f"尝试连接 Telegram API (尝试 {attempt}/{max_retries})...")
             await app.initialize()
             await app.start()
-            await app.updater.start_polling(drop_pending_updates=True)
+            # 长轮询：没有新消息时 getUpdates 挂起等待，有消息立即返回，
+            # 空闲时不再每 10 秒（PTB 默认）发起一次往返；读超时会自动加上该等待时间
+            await app.updater.start_polling(drop_pending_updates=True, timeout=POLLING_TIMEOUT)
             break
         except telegram.error.NetworkError as e:
             # 连接失败需要回滚已初始化的部分，避免下次 initialize 报错
@@ -97,8 +127,10 @@ async def run_bot():
             except Exception:
                 pass
             if attempt < max_retries:
-                logger.error(f"连接 Telegram 失败: {e}. 将在 {retry_delay} 秒后重试...")
-                await asyncio.sleep(retry_delay)
+                # 指数退避叠加 0.5~1.5 倍随机抖动，多个实例共用代理时不会同时重连
+                delay = retry_delay * random.uniform(0.5, 1.5)
+                logger.error(f"连接 Telegram 失败: {e}. 将在 {delay:.1f} 秒后重试...")
+                await asyncio.sleep(delay)
                 retry_delay = min(retry_delay * 2, 60)
             else:
                 logger.critical("=" * 60)
@@ -132,6 +164,20 @@ async def run_bot():
             await app.shutdown()
         except Exception as e:
             logger.error(f"停止机器人时出错: {e}")
+        # 收集中的媒体组状态由后台线程延迟写盘，退出前同步刷一次，避免丢失最后的变更
+        try:
+            bot.flush_media_groups_collection()
+        except Exception as e:
+            logger.error(f"退出时保存媒体组收集状态失败: {e}")
+
+
+def _event_loop_factory():
+    """优先使用 uvloop（基于 libuv，回调调度与网络 I/O 更快）；未安装时回退到标准事件循环。"""
+    try:
+        import uvloop
+    except ImportError:
+        return None
+    return uvloop.new_event_loop
 
 
 def main() -> None:
@@ -144,6 +190,11 @@ def main() -> None:
     init_db()
     bot.load_media_groups_collection()
 
+    # 启动时还没有任何下载在进行，此时残留的临时文件都是上次中断留下的
+    removed = sweep_temp_files()
+    if removed:
+        logger.info(f"已清理 {removed} 个残留的临时文件")
+
     # 预启动 User API (MTProto)；放后台线程，避免首次登录阻塞
     if USER_API_ENABLED:
         logger.info("检测到 API 凭据，准备初始化 User API (MTProto)...")
@@ -156,7 +207,8 @@ def main() -> None:
 
     logger.info("启动机器人...")
     try:
-        asyncio.run(run_bot())
+        with asyncio.Runner(loop_factory=_event_loop_factory()) as runner:
+            runner.run(run_bot())
     except (KeyboardInterrupt, SystemExit):
         logger.info("程序被用户中断")
     except Exception:
@@ -9,10 +9,11 @@ import asyncio
 import time
 import threading
 import mimetypes
-import re
 from urllib.parse import urlparse
 from datetime import timezone
 
+from utils import drop_page_cache, sanitize_name
+
 # --- 全局状态 ---
 _app = None
 _loop = None
@@ -226,7 +227,7 @@ def _message_media_info(message):
 
     chat = message.chat
     source_name = getattr(chat, 'title', None) or getattr(chat, 'username', None) or getattr(chat, 'first_name', None) or str(getattr(chat, 'id', 'unknown'))
-    source_name = re.sub(r'[\\/*?:"<>|]', "_", source_name)
+    source_name = sanitize_name(source_name)
     source_username = getattr(chat, 'username', None) or ''
     source_link1 = getattr(message, 'link', None)
     if not source_link1 and source_username:
@@ -331,11 +332,12 @@ async def _do_download(chat_id, message_id, final_path, progress_callback=None,
                 # 为了确保下载文件的完整性，每次重试下载前都先删除可能存在的残留文件
                 # 同时清理 Pyrogram 可能遗留的 .temp 或 .part 临时文件，彻底防止错误续传
                 for p in [final_path, final_path + ".temp", final_path + ".part"]:
-                    if os.path.exists(p):
-                        try:
-                            os.remove(p)
-                        except Exception as e:
-                            logger.warning(f"无法清理旧文件 {p}: {e}")
+                    try:
+                        os.remove(p)
+                    except FileNotFoundError:
+                        pass
+                    except Exception as e:
+                        logger.warning(f"无法清理旧文件 {p}: {e}")
                 
                 logger.info(f"DEBUG: 正在获取消息 {chat_id}/{message_id}")
                 msg = await client.get_messages(chat_id, message_id)
@@ -489,7 +491,10 @@ def run_download_large_file(chat_id, message_id, final_path, progress_callback=N
     )
     try:
         # 大文件下载允许较长时间，但设置上限以防永久挂死 (默认 1 小时)
-        return future.result(timeout=3600)
+        success = future.result(timeout=3600)
+        if success:
+            drop_page_cache(final_path)
+        return success
     except Exception as e:
         logger.error(f"User API 任务执行抛出异常: {e}", exc_info=True)
         return False
@@ -532,7 +537,10 @@ def run_download_message_media(chat_id, message_id, final_path, progress_callbac
     )
     try:
         downloaded_path = future.result(timeout=3600)
-        return bool(downloaded_path and os.path.exists(downloaded_path))
+        if not (downloaded_path and os.path.exists(downloaded_path)):
+            return False
+        drop_page_cache(downloaded_path)
+        return True
     except Exception as e:
         logger.error(f"User API 链接下载任务失败: {e}", exc_info=True)
         return False
@@ -5,11 +5,13 @@ import os
 import time
 import errno
 import json
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import logging
 import mimetypes
 import re
 import sqlite3
+import queue
+import atexit
 import threading
 import contextlib
 
@@ -39,6 +41,56 @@ def utc_to_local(dt):
     return dt.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
 
 
+# 文件/目录名中不允许出现的字符，统一替换为下划线 (str.translate 查表，无需正则)
+_UNSAFE_NAME_CHARS = str.maketrans({c: '_' for c in '\\/*?:"<>|'})
+
+def sanitize_name(name):
+    """把来源名称中不能用于文件/目录名的字符替换为下划线。"""
+    return name.translate(_UNSAFE_NAME_CHARS)
+
+
+# 本进程内已确认存在的目录，避免每个文件都对路径逐级 stat
+# 格式: {目录: time.monotonic() 确认时间}；过期后重新确认一次，
+# 以防目录在运行期间被手动删除/移走后一直返回不存在的路径
+_ensured_dirs = {}
+_ensured_dirs_lock = threading.Lock()
+ENSURED_DIR_TTL = 10 * 60
+
+def ensure_dir(path):
+    """确保目录存在并返回该路径；TTL 内确认过的目录直接返回，不再逐级 stat。
+
+    重试处理 ESTALE (Stale file handle) — Docker overlay 文件系统常见问题
+    """
+    with _ensured_dirs_lock:
+        ensured_at = _ensured_dirs.get(path)
+        if ensured_at is not None and time.monotonic() - ensured_at < ENSURED_DIR_TTL:
+            return path
+
+    for attempt in range(3):
+        try:
+            os.makedirs(path, exist_ok=True)
+            with _ensured_dirs_lock:
+                _ensured_dirs[path] = time.monotonic()
+            return path
+        except OSError as e:
+            if e.errno == errno.ESTALE and attempt < 2:
+                time.sleep(0.5 * (attempt + 1))
+                continue
+            raise
+
+    return path
+
+# 私聊类来源统一归到 direct_messages 下
+_DIRECT_SOURCE_TYPES = frozenset(("user", "private_user", "unknown_forward"))
+
+def resolve_save_directory(source_name=None, source_type=None):
+    """只计算来源对应的保存目录路径，不访问文件系统（删除等只需路径的场景使用）"""
+    if not source_name:
+        return os.path.join(SAVE_DIR, "unsorted")
+    if source_type in _DIRECT_SOURCE_TYPES:
+        return os.path.join(SAVE_DIR, "direct_messages", source_name)
+    return os.path.join(SAVE_DIR, source_name)
+
 def get_save_directory(user, source_name=None, source_type=None):
     """创建并返回保存目录路径 (统一媒体库版)
     
@@ -50,87 +102,117 @@ def get_save_directory(user, source_name=None, source_type=None):
     Returns:
         str: 保存目录的完整路径
     """
-    if not source_name:
-        source_dir = os.path.join(SAVE_DIR, "unsorted")
-    elif source_type in ["user", "private_user", "unknown_forward"]:
-        source_dir = os.path.join(SAVE_DIR, "direct_messages", source_name)
-    else:
-        source_dir = os.path.join(SAVE_DIR, source_name)
-    
-    # 确保目录存在
-    # 重试处理 ESTALE (Stale file handle) — Docker overlay 文件系统常见问题
-    for attempt in range(3):
+    return ensure_dir(resolve_save_directory(source_name, source_type))
+
+# 下载中断后可能残留的临时文件：Bot API 写盘的 *.part、Pyrogram 的 *.temp、
+# 旧版本的 *_temp 与 *_temp_N
+_TEMP_SUFFIXES = ('.part', '.temp', '_temp')
+
+def _is_temp_name(name):
+    if name.endswith(_TEMP_SUFFIXES):
+        return True
+    stem, sep, index = name.rpartition('_temp_')
+    return bool(sep and stem and index.isdigit())
+
+def sweep_temp_files(root=SAVE_DIR, min_age=0):
+    """清理 root 下（含子目录）残留的下载临时文件，返回删除的数量。
+
+    用 os.scandir 遍历，文件名与类型都取自目录项本身，不再对每个文件额外 stat。
+    min_age > 0 时只删除超过该秒数未再写入的临时文件，运行期间不会误删正在下载的文件。
+    """
+    removed = 0
+    cutoff = time.time() - min_age
+    pending = [root]
+    while pending:
         try:
-            if not os.path.exists(source_dir):
-                os.makedirs(source_dir, exist_ok=True)
-            return source_dir
-        except OSError as e:
-            if e.errno == errno.ESTALE and attempt < 2:
-                time.sleep(0.5 * (attempt + 1))
-                continue
-            raise
-    
-    return source_dir
+            it = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif _is_temp_name(entry.name) and entry.is_file(follow_symlinks=False):
+                    try:
+                        if min_age and entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                            continue
+                        os.remove(entry.path)
+                        removed += 1
+                    except OSError:
+                        pass
+    return removed
+
+def read_file_header(source, size=32):
+    """读取文件头若干字节。source 可以是文件路径，也可以是已下载到内存的 bytes/bytearray。
+
+    读取失败时返回 None。
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:size])
+    try:
+        with open(source, 'rb') as f:
+            return f.read(size)
+    except Exception as e:
+        logger.error(f"读取文件头部错误: {e}")
+        return None
+
+# 视频容器的文件头魔数（前 4 字节）
+_VIDEO_MAGIC = {
+    b'\x1A\x45\xDF\xA3': '.webm',  # WebM / Matroska (EBML)
+    b'RIFF': '.avi',               # AVI
+}
+# ISO-BMFF 的 ftyp brand；表中没有的 (isom/mp41/mp42/avc1/dash 等) 一律按 MP4 处理
+_VIDEO_FTYP_BRANDS = {
+    b'qt  ': '.mov',  # QuickTime
+}
+# HEIC/HEIF 图片的 ftyp brand
+_HEIF_BRANDS = frozenset((b'heic', b'heix', b'hevc', b'mif1', b'heif'))
 
-def get_video_extension(file_path):
+def get_video_extension(source):
     """检测视频文件的实际格式并返回正确的扩展名
     
     Args:
-        file_path: 视频文件路径
+        source: 视频文件路径，或已下载到内存的文件内容 (bytes/bytearray)
         
     Returns:
         str: 正确的文件扩展名（带点，如.mp4）
     """
-    # 初始化mimetypes
-    if not mimetypes.inited:
-        mimetypes.init()
-    
-    # 尝试通过文件头部字节判断
-    video_signatures = {
-        b'\x00\x00\x00\x18\x66\x74\x79\x70\x6D\x70\x34\x32': '.mp4',  # MP4
-        b'\x00\x00\x00\x1C\x66\x74\x79\x70\x6D\x70\x34\x32': '.mp4',  # MP4
-        b'\x00\x00\x00\x20\x66\x74\x79\x70\x69\x73\x6F\x6D': '.mp4',  # MP4 (ISO)
-        b'\x1A\x45\xDF\xA3': '.webm',  # WebM
-        b'\x00\x00\x00\x14\x66\x74\x79\x70\x71\x74\x20\x20': '.mov',  # QuickTime
-        b'\x52\x49\x46\x46': '.avi'    # AVI
-    }
-    
-    try:
-        with open(file_path, 'rb') as f:
-            header = f.read(12)  # 读取前12字节
-            for sig, ext in video_signatures.items():
-                if header.startswith(sig):
-                    return ext
-    except Exception as e:
-        logger.error(f"读取文件头部错误: {e}")
-    
-    # 通过mime类型判断
-    mime_type, _ = mimetypes.guess_type(file_path)
-    if mime_type and mime_type.startswith('video/'):
-        ext = mimetypes.guess_extension(mime_type)
+    # 尝试通过文件头部字节判断：ISO-BMFF (MP4/MOV) 看 ftyp box 的 brand，其余看前 4 字节
+    header = read_file_header(source, 12)  # 读取前12字节
+    if header:
+        if header[4:8] == b'ftyp':
+            return _VIDEO_FTYP_BRANDS.get(header[8:12], '.mp4')
+        ext = _VIDEO_MAGIC.get(header[:4])
         if ext:
             return ext
     
+    # 通过mime类型判断（仅在传入路径时可用）
+    if isinstance(source, str):
+        if not mimetypes.inited:
+            mimetypes.init()
+        mime_type, _ = mimetypes.guess_type(source)
+        if mime_type and mime_type.startswith('video/'):
+            ext = mimetypes.guess_extension(mime_type)
+            if ext:
+                return ext
+    
     # 如果无法检测，默认为mp4
-    logger.warning(f"无法检测视频类型: {file_path}, 使用默认.mp4扩展名")
+    logger.warning(f"无法检测视频类型: {source if isinstance(source, str) else '内存数据'}, 使用默认.mp4扩展名")
     return '.mp4'
 
-def get_image_extension(file_path):
+def get_image_extension(source):
     """检测图片文件的实际格式并返回正确的扩展名
 
     Python 3.13 移除了标准库 imghdr，这里改用文件头魔数 (magic bytes) 自行判断。
 
     Args:
-        file_path: 图片文件路径
+        source: 图片文件路径，或已下载到内存的文件内容 (bytes/bytearray)
 
     Returns:
         str: 正确的文件扩展名（带点，如.jpg）
     """
-    try:
-        with open(file_path, 'rb') as f:
-            header = f.read(32)
-    except Exception as e:
-        logger.error(f"读取图片文件头失败: {e}")
+    header = read_file_header(source, 32)
+    if header is None:
         return '.jpg'
 
     # 按文件头魔数判断常见图片格式
@@ -148,22 +230,54 @@ def get_image_extension(file_path):
     if header.startswith(b'II*\x00') or header.startswith(b'MM\x00*'):
         return '.tiff'
     # HEIC/HEIF: ftyp box，brand 含 heic/heif/mif1
-    if header[4:8] == b'ftyp' and header[8:12] in (b'heic', b'heix', b'hevc', b'mif1', b'heif'):
+    if header[4:8] == b'ftyp' and header[8:12] in _HEIF_BRANDS:
         return '.heic'
 
-    logger.warning(f"无法检测图片类型: {file_path}, 使用默认.jpg扩展名")
+    logger.warning(f"无法检测图片类型: {source if isinstance(source, str) else '内存数据'}, 使用默认.jpg扩展名")
     return '.jpg'
 
+def drop_page_cache(file_path):
+    """提示内核下载完的文件不会再被读取，可从页缓存中释放。
+
+    机器人只写不读，整组大图/视频留在页缓存里只会挤掉数据库、日志等热数据。
+    刚写完的页还是脏页，DONTNEED 不会丢弃它们，所以先 fdatasync 落盘再提示；
+    这会阻塞到数据写完，调用方都在线程池中执行。
+    仅 Linux 等支持 posix_fadvise 的平台生效；尽力而为，失败不影响下载结果。
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fdatasync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# 上一次发放的毫秒时间戳，保证进程内严格递增
+_last_stamp = 0
+_stamp_lock = threading.Lock()
+
 def generate_temp_filename(media_group_id=None):
     """生成临时文件名关键字（不带扩展名）
-    
+
+    开启 concurrent_updates 后多条消息可能在同一毫秒内到达，
+    这里保证同一进程内发放的时间戳严格递增，避免文件名冲突互相覆盖。
+
     Args:
         media_group_id: 可选的媒体组ID
         
     Returns:
         str: 生成的标识符
     """
-    timestamp = int(time.time() * 1000)
+    global _last_stamp
+    with _stamp_lock:
+        timestamp = max(time.time_ns() // 1_000_000, _last_stamp + 1)
+        _last_stamp = timestamp
     if media_group_id:
         return str(timestamp)
     return f"single_{timestamp}"
@@ -259,41 +373,54 @@ def init_db():
 # 全局数据库锁，由于 SQLite 在多线程写入时容易锁表，使用此锁确保串口化写入
 _db_lock = threading.Lock()
 
-def get_db_connection():
-    """获取数据库连接 (WAL 模式, 60s 超时)"""
-    conn = sqlite3.connect(DB_PATH, timeout=60)
+# 机器人进程内共享的长连接，首次使用时打开；所有访问都在 _db_lock 内进行
+_shared_conn = None
+
+def get_db_connection(check_same_thread=True):
+    """获取数据库连接 (WAL 模式, synchronous=NORMAL, 60s 超时)
+
+    WAL 下 synchronous=NORMAL 仍能保证数据库一致，只是断电时可能丢失最后几次提交，
+    换来每次提交不再 fsync。
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=60, check_same_thread=check_same_thread)
     try:
         conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
     except:
         pass
     return conn
 
 @contextlib.contextmanager
-def get_db_cursor():
-    """数据库游标上下文管理器，自动加锁并在结束时释放"""
+def _locked_connection():
+    """加锁后取得共享连接，省去每次查询都重新打开数据库、设置 PRAGMA 的开销。
+
+    出错时回滚，避免失败语句留下的未结束事务影响后续调用。
+    """
+    global _shared_conn
     with _db_lock:
-        conn = get_db_connection()
+        if _shared_conn is None:
+            _shared_conn = get_db_connection(check_same_thread=False)
         try:
-            yield conn.cursor()
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            yield _shared_conn
+        except Exception:
+            _shared_conn.rollback()
+            raise
+
+@contextlib.contextmanager
+def get_db_cursor():
+    """数据库游标上下文管理器，自动加锁并在结束时提交"""
+    with _locked_connection() as conn:
+        yield conn.cursor()
+        conn.commit()
 
 def get_duplicate_info(file_unique_id):
     """根据 unique_id 查找重复项"""
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT filename, source_name, caption, source_username, source_link1, source_link2 FROM media_metadata WHERE file_unique_id = ?
-            ''', (file_unique_id,))
-            row = cursor.fetchone()
-        finally:
-            conn.close()
+    with _locked_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT filename, source_name, caption, source_username, source_link1, source_link2 FROM media_metadata WHERE file_unique_id = ?
+        ''', (file_unique_id,))
+        row = cursor.fetchone()
     
     if row:
         return {
@@ -307,32 +434,42 @@ def get_duplicate_info(file_unique_id):
     return None
 
 
+# (缓存失效的时间戳, 日期字符串)；整体替换元组，多线程读到的两项总是一致的
+_today_cache = (0.0, '')
+
+def today_str():
+    """返回本地日期字符串 YYYY-MM-DD，缓存到本地时间的下一个午夜。"""
+    global _today_cache
+    until, value = _today_cache
+    if time.time() >= until:
+        now = datetime.now()
+        next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        value = now.strftime("%Y-%m-%d")
+        _today_cache = (next_midnight.timestamp(), value)
+    return value
+
+
 def get_library_stats():
     """统计媒体库概况：总数、今日新增、按来源 Top、按类型分布。"""
     stats = {'total': 0, 'today': 0, 'by_type': {}, 'top_sources': []}
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM media_metadata")
-            stats['total'] = cur.fetchone()[0]
-
-            # 今日新增（datetime 以 ISO 字符串存储，按日期前缀匹配）
-            today = datetime.now().strftime("%Y-%m-%d")
-            cur.execute("SELECT COUNT(*) FROM media_metadata WHERE datetime LIKE ?", (f"{today}%",))
-            stats['today'] = cur.fetchone()[0]
-
-            cur.execute("SELECT media_type, COUNT(*) FROM media_metadata GROUP BY media_type")
-            stats['by_type'] = {row[0] or 'unknown': row[1] for row in cur.fetchall()}
-
-            cur.execute(
-                "SELECT source_name, COUNT(*) AS c FROM media_metadata "
-                "WHERE source_name IS NOT NULL AND source_name != '' "
-                "GROUP BY source_name ORDER BY c DESC LIMIT 5"
-            )
-            stats['top_sources'] = [(row[0], row[1]) for row in cur.fetchall()]
-        finally:
-            conn.close()
+    with _locked_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM media_metadata")
+        stats['total'] = cur.fetchone()[0]
+
+        # 今日新增（datetime 以 ISO 字符串存储，按日期前缀匹配）
+        cur.execute("SELECT COUNT(*) FROM media_metadata WHERE datetime LIKE ?", (f"{today_str()}%",))
+        stats['today'] = cur.fetchone()[0]
+
+        cur.execute("SELECT media_type, COUNT(*) FROM media_metadata GROUP BY media_type")
+        stats['by_type'] = {row[0] or 'unknown': row[1] for row in cur.fetchall()}
+
+        cur.execute(
+            "SELECT source_name, COUNT(*) AS c FROM media_metadata "
+            "WHERE source_name IS NOT NULL AND source_name != '' "
+            "GROUP BY source_name ORDER BY c DESC LIMIT 5"
+        )
+        stats['top_sources'] = [(row[0], row[1]) for row in cur.fetchall()]
     return stats
 
 
@@ -346,40 +483,36 @@ def save_to_db(user, media_obj, file_name, save_dir=None, media_group_id=None, m
         message_time = message_time.replace('+00:00', '').replace('+0000', '').replace('Z', '')
     
     try:
-        with _db_lock:
-            conn = get_db_connection()
-            try:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO media_metadata (
-                        user_id, user_name, filename, datetime, file_id, file_unique_id,
-                        media_group_id, media_type, caption, source_name, source_id,
-                        source_username, source_link1, source_link2, source_type, message_time, message_id, remark
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    user.id,
-                    user.username or user.first_name,
-                    file_name,
-                    datetime.now().isoformat(),
-                    media_obj.file_id,
-                    media_obj.file_unique_id,
-                    media_group_id or '',
-                    media_type,
-                    caption,
-                    source_name or '',
-                    source_id or '',
-                    source_username or '',
-                    source_link1 or '',
-                    source_link2 or '',
-                    source_type or 'unknown',
-                    message_time,
-                    message_id,
-                    remark or '',
-                ))
-                conn.commit()
-            finally:
-                conn.close()
-        logger.debug(f"已将{media_type}元数据保存至数据库")
+        with _locked_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO media_metadata (
+                    user_id, user_name, filename, datetime, file_id, file_unique_id,
+                    media_group_id, media_type, caption, source_name, source_id,
+                    source_username, source_link1, source_link2, source_type, message_time, message_id, remark
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                user.id,
+                user.username or user.first_name,
+                file_name,
+                datetime.now().isoformat(),
+                media_obj.file_id,
+                media_obj.file_unique_id,
+                media_group_id or '',
+                media_type,
+                caption,
+                source_name or '',
+                source_id or '',
+                source_username or '',
+                source_link1 or '',
+                source_link2 or '',
+                source_type or 'unknown',
+                message_time,
+                message_id,
+                remark or '',
+            ))
+            conn.commit()
+        logger.debug("已将%s元数据保存至数据库", media_type)
 
         return True
     except sqlite3.IntegrityError:
@@ -397,42 +530,38 @@ def delete_media_by_id(record_ids):
     deleted_count = 0
 
     try:
-        with _db_lock:
-            conn = get_db_connection()
-            try:
-                cursor = conn.cursor()
-                placeholders = ",".join("?" * len(record_ids))
-
-                # 1. 一次性查出所有待删除记录的信息（避免 N+1 查询）
-                cursor.execute(
-                    f"SELECT id, filename, source_name, source_type, user_id, user_name "
-                    f"FROM media_metadata WHERE id IN ({placeholders})",
-                    tuple(record_ids),
-                )
-                rows = cursor.fetchall()
-
-                for _id, filename, source_name, source_type, user_id, user_name in rows:
-                    user_stub = type('User', (), {'id': user_id, 'username': user_name, 'first_name': user_name})
-                    save_dir = get_save_directory(user_stub, source_name, source_type)
-                    file_path = os.path.join(save_dir, filename)
-
-                    # 物理删除文件
-                    if os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                            logger.info(f"已物理删除文件: {file_path}")
-                        except Exception as e:
-                            logger.error(f"物理删除文件失败 {file_path}: {e}")
-
-                # 2. 一次性从数据库删除所有记录
-                cursor.execute(
-                    f"DELETE FROM media_metadata WHERE id IN ({placeholders})",
-                    tuple(record_ids),
-                )
-                deleted_count = cursor.rowcount
-                conn.commit()
-            finally:
-                conn.close()
+        with _locked_connection() as conn:
+            cursor = conn.cursor()
+            placeholders = ",".join("?" * len(record_ids))
+
+            # 1. 一次性查出所有待删除记录的信息（避免 N+1 查询）
+            cursor.execute(
+                f"SELECT id, filename, source_name, source_type "
+                f"FROM media_metadata WHERE id IN ({placeholders})",
+                tuple(record_ids),
+            )
+            rows = cursor.fetchall()
+
+            for _id, filename, source_name, source_type in rows:
+                save_dir = resolve_save_directory(source_name, source_type)
+                file_path = os.path.join(save_dir, filename)
+
+                # 物理删除文件
+                try:
+                    os.remove(file_path)
+                    logger.info(f"已物理删除文件: {file_path}")
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.error(f"物理删除文件失败 {file_path}: {e}")
+
+            # 2. 一次性从数据库删除所有记录
+            cursor.execute(
+                f"DELETE FROM media_metadata WHERE id IN ({placeholders})",
+                tuple(record_ids),
+            )
+            deleted_count = cursor.rowcount
+            conn.commit()
 
     except Exception as e:
         logger.error(f"按 ID 批量删除媒体记录失败: {e}")
@@ -444,18 +573,14 @@ def delete_media_records(file_unique_ids):
     if not file_unique_ids:
         return 0
 
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            placeholders = ",".join("?" * len(file_unique_ids))
-            cursor.execute(
-                f"SELECT id FROM media_metadata WHERE file_unique_id IN ({placeholders})",
-                tuple(file_unique_ids),
-            )
-            ids = [row[0] for row in cursor.fetchall()]
-        finally:
-            conn.close()
+    with _locked_connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ",".join("?" * len(file_unique_ids))
+        cursor.execute(
+            f"SELECT id FROM media_metadata WHERE file_unique_id IN ({placeholders})",
+            tuple(file_unique_ids),
+        )
+        ids = [row[0] for row in cursor.fetchall()]
 
     return delete_media_by_id(ids)
 
@@ -464,6 +589,12 @@ def delete_media_records(file_unique_ids):
 
 AUDIT_DIR = DATA_DIR
 _audit_lock = threading.Lock()
+# 审计记录由后台线程批量写入，消息处理（事件循环）只负责入队
+_audit_queue = queue.Queue()
+_audit_writer_started = False
+# 每批最多等待的秒数与条数
+AUDIT_BATCH_WAIT = 0.5
+AUDIT_BATCH_SIZE = 32
 
 
 def _audit_source_type(entry):
@@ -537,41 +668,38 @@ def append_audit(msg_type, message=None, group_info=None, raw_dict=None, note=No
         'type': msg_type,
     }
 
-    if message is not None:
+    if isinstance(message, dict):
+        entry['raw'] = message
+    elif message is not None:
         try:
-            if hasattr(message, 'to_dict'):
-                entry['raw'] = message.to_dict()
-            elif isinstance(message, dict):
-                entry['raw'] = message
+            entry['raw'] = message.to_dict()
         except Exception:
             pass
 
-        # 提取常用字段方便 grep
+        # 提取常用字段方便 grep；PTB Message 上这些属性总是存在（没有时为 None），直接读取
         try:
-            if hasattr(message, 'chat') and message.chat:
-                entry['chat_id'] = message.chat.id
-                entry['chat_type'] = message.chat.type
-            if hasattr(message, 'from_user') and message.from_user:
+            chat = message.chat
+            if chat:
+                entry['chat_id'] = chat.id
+                entry['chat_type'] = chat.type
+            if message.from_user:
                 entry['user_id'] = message.from_user.id
-            if hasattr(message, 'caption') and message.caption:
+            if message.caption:
                 entry['caption'] = message.caption[:500]
-            if hasattr(message, 'media_group_id') and message.media_group_id:
+            if message.media_group_id:
                 entry['media_group_id'] = message.media_group_id
-            # 原始消息 ID 和时间
-            fo = getattr(message, 'forward_origin', None)
+            # 原始消息 ID 和时间；只有频道来源 (MessageOriginChannel) 带 message_id
+            fo = message.forward_origin
             if fo:
-                msg_id = getattr(fo, 'message_id', None) or getattr(message, 'message_id', None)
-                msg_date = getattr(fo, 'date', None)
+                msg_id = getattr(fo, 'message_id', None) or message.message_id
+                msg_date = fo.date
             else:
                 msg_id = message.message_id
-                msg_date = getattr(message, 'date', None)
+                msg_date = message.date
             if msg_id is not None:
                 entry['message_id'] = msg_id
             if msg_date is not None:
-                try:
-                    entry['message_time'] = msg_date.isoformat() if hasattr(msg_date, 'isoformat') else str(msg_date)
-                except Exception:
-                    pass
+                entry['message_time'] = msg_date.isoformat()
         except Exception:
             pass
 
@@ -603,7 +731,8 @@ def append_audit(msg_type, message=None, group_info=None, raw_dict=None, note=No
             if isinstance(raw_msg, dict):
                 entry['raw'] = raw_msg
             else:
-                entry['raw'] = {k: v for k, v in group_info.items() if k != 'raw_message'}
+                # 下划线开头的键是仅存于内存的辅助索引（集合等），不写入审计
+                entry['raw'] = {k: v for k, v in group_info.items() if k != 'raw_message' and not k.startswith('_')}
         except Exception:
             pass
 
@@ -616,19 +745,108 @@ def append_audit(msg_type, message=None, group_info=None, raw_dict=None, note=No
     try:
         st = _audit_source_type(entry)
         entry['source_type'] = st
-        path = _audit_path(st)
+        # 入队前就序列化成文本：entry['raw'] 可能引用下载线程仍在修改的
+        # media_items，留到写线程再序列化会记下之后的状态，甚至因
+        # "dictionary changed size during iteration" 失败
+        text = _audit_entry_text(entry)
+    except Exception as e:
+        logger.warning(f"写入审计日志失败: {e}")
+        return
+    _start_audit_writer()
+    _audit_queue.put((_audit_path(st), text))
+
+
+def _audit_entry_text(entry):
+    """把单条审计记录序列化成数组元素的文本，缩进与 json.dump(indent=2) 一致"""
+    text = json.dumps(entry, ensure_ascii=False, indent=2)
+    return '\n'.join('  ' + line for line in text.split('\n'))
+
+
+def _append_json_array(path, new_texts):
+    """在已有 JSON 数组文件末尾原地追加元素，只读尾部几十字节、只写新增部分。
+
+    new_texts 是 _audit_entry_text 序列化好的元素文本，输出格式与
+    json.dump(..., indent=2) 整体写出的一致。文件不存在、为空或结尾不是 ']'
+    时返回 False，由调用方退回整体重写。
+    """
+    body = ',\n'.join(new_texts).encode('utf-8')
+    try:
+        f = open(path, 'r+b')
+    except FileNotFoundError:
+        return False
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        tail_start = max(0, end - 64)
+        f.seek(tail_start)
+        tail = f.read().rstrip()
+        if not tail.endswith(b']'):
+            return False
+        before = tail[:-1].rstrip()
+        if not before:
+            return False
+        sep = b'\n' if before.endswith(b'[') else b',\n'
+        f.seek(tail_start + len(before))
+        f.write(sep + body + b'\n]')
+        f.truncate()
+    return True
+
+
+def _write_audit_entries(path, new_texts):
+    """把一批已序列化的审计记录追加到对应文件。
+
+    正常情况下原地追加到数组末尾；文件不存在或已损坏时才读出 → 追加 → 整体写回。
+    """
+    try:
         with _audit_lock:
-            entries = []
-            if os.path.exists(path):
-                try:
-                    with open(path, 'r', encoding='utf-8') as f:
-                        existing = json.load(f)
-                    if isinstance(existing, list):
-                        entries = existing
-                except Exception:
-                    entries = []
-            entries.append(entry)
+            if _append_json_array(path, new_texts):
+                return
+            # 文件不存在 (首次写入) 与内容损坏一样，从空数组开始
+            parts = []
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    existing = json.load(f)
+                if isinstance(existing, list) and existing:
+                    # 去掉 "[\n" 与 "\n]"，得到按数组元素缩进好的正文
+                    parts.append(json.dumps(existing, ensure_ascii=False, indent=2)[2:-2])
+            except Exception:
+                parts = []
+            parts.extend(new_texts)
             with open(path, 'w', encoding='utf-8') as f:
-                json.dump(entries, f, ensure_ascii=False, indent=2)
+                f.write('[\n' + ',\n'.join(parts) + '\n]')
     except Exception as e:
         logger.warning(f"写入审计日志失败: {e}")
+
+
+def _audit_writer_loop():
+    while True:
+        batch = [_audit_queue.get()]
+        # 攒一小会儿再写：同一批里发往同一文件的记录只读写一次文件
+        deadline = time.monotonic() + AUDIT_BATCH_WAIT
+        while len(batch) < AUDIT_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_audit_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        by_path = {}
+        for path, text in batch:
+            by_path.setdefault(path, []).append(text)
+        for path, entries in by_path.items():
+            _write_audit_entries(path, entries)
+        for _ in batch:
+            _audit_queue.task_done()
+
+
+def _start_audit_writer():
+    """首次记录时启动后台写线程；退出时等待队列中的记录写完。"""
+    global _audit_writer_started
+    if _audit_writer_started:
+        return
+    with _audit_lock:
+        if _audit_writer_started:
+            return
+        threading.Thread(target=_audit_writer_loop, name="audit-writer", daemon=True).start()
+        atexit.register(_audit_queue.join)
+        _audit_writer_started = True